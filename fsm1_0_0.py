@@ -1,49 +1,238 @@
 import sys
 import json
+import csv
+import io
 import math
 import os
+import re
+import mmap
+import time
+import struct
+import zlib
+import random
+import heapq
+import argparse
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+from collections import namedtuple, Counter, deque
+from functools import lru_cache
+from difflib import SequenceMatcher
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QHBoxLayout, 
                              QVBoxLayout, QTableWidget, QTableWidgetItem, 
                              QPushButton, QLabel, QHeaderView, QComboBox, 
-                             QFileDialog, QCompleter, QStyledItemDelegate, QLineEdit, QTextEdit, QTabWidget, QMessageBox)
-from PySide6.QtGui import QPixmap, QColor, QFont
-from PySide6.QtCore import Qt
+                             QFileDialog, QCompleter, QStyledItemDelegate, QLineEdit, QTextEdit, QTabWidget, QMessageBox,
+                             QProgressDialog, QCheckBox, QSpinBox, QDoubleSpinBox, QInputDialog, QPlainTextEdit)
+from PySide6.QtGui import (QPixmap, QColor, QFont, QImage, QPainter, QPen, QTextCursor, QTextCharFormat, QTextFormat,
+                           QAction, QKeySequence, QSyntaxHighlighter)
+from PySide6.QtCore import Qt, QTimer, Signal, QEvent, QStringListModel, QPointF, QRectF, QItemSelection, QItemSelectionModel
 import graphviz
 
 # --- 1. UI 组件：增强型补全输入框 ---
+# 补全索引：小写前缀树 + 按首字母分桶的子序列模糊匹配；sync 只增删变化的词，全表共用
+class CompletionIndex:
+    def __init__(self):
+        self.root, self.words, self.by_head, self.blobs = {}, set(), {}, {}
+
+    def add(self, word):
+        if word in self.words: return
+        node = self.root; self.words.add(word)
+        for ch in word.lower(): node = node.setdefault(ch, {})
+        node.setdefault(None, set()).add(word); self.by_head.setdefault(word[0].lower(), set()).add(word)
+        self.blobs.pop(word[0].lower(), None)
+
+    def discard(self, word):
+        if word not in self.words: return
+        path = [self.root]; self.words.discard(word)
+        for ch in word.lower(): path.append(path[-1][ch])
+        path[-1][None].discard(word); self.by_head[word[0].lower()].discard(word); self.blobs.pop(word[0].lower(), None)
+        if not path[-1][None]: del path[-1][None]
+        for ch, parent, node in zip(reversed(word.lower()), reversed(path[:-1]), reversed(path[1:])):
+            if node: break
+            del parent[ch]
+
+    def sync(self, words):
+        words = {w for w in words if w}
+        if words == self.words: return
+        for w in self.words - words: self.discard(w)
+        for w in words - self.words: self.add(w)
+
+    def complete(self, text, limit=20):
+        key, node, out = text.lower(), self.root, []
+        for ch in key:
+            node = node.get(ch)
+            if node is None: break
+        if node is not None:  # 前缀命中：按层遍历，短词在前
+            queue = deque([node])
+            while queue and len(out) < limit:
+                n = queue.popleft(); out += sorted(n.get(None, ()))
+                queue.extend(n[ch] for ch in sorted(k for k in n if k is not None))
+        if len(out) < limit and len(key) > 1 and key[0] in self.by_head:  # 模糊匹配：首字母相同、其余字符按顺序出现
+            if key[0] not in self.blobs: self.blobs[key[0]] = "\n".join(self.by_head[key[0]])
+            pat = "^" + re.escape(key[0]) + "".join(f"[^{re.escape(c)}\n]*{re.escape(c)}" for c in key[1:]) + "[^\n]*$"
+            seen = set(out)  # 每一步只吞到下一个所需字符为止，整桶在正则引擎内一次扫描完
+            cand = (w for w in re.findall(pat, self.blobs[key[0]], re.M | re.I) if w not in seen)
+            out += heapq.nsmallest(limit - len(out), cand, key=lambda w: (len(w), w))
+        return out[:limit]
+
+_STATE_WORD_RE = re.compile(r"[\w$.]*$")
+_IDENT_WORD_RE = re.compile(r"[A-Za-z_][\w$]*$")
+
 class TabLineEdit(QLineEdit):
-    def keyPressEvent(self, event):
-        popup = self.completer().popup() if self.completer() else None
-        if popup and popup.isVisible():
-            if event.key() in (Qt.Key_Tab, Qt.Key_Enter, Qt.Key_Return):
-                index = popup.currentIndex()
-                if not index.isValid():
-                    index = self.completer().completionModel().index(0, 0)
-                res = self.completer().completionModel().data(index)
-                self.setText(res)
-                self.completer().popup().hide()
-                return 
-        super().keyPressEvent(event)
+    def __init__(self, parent, index, word_re):
+        super().__init__(parent)
+        self.index, self.word_re, self.model = index, word_re, QStringListModel(self)
+        self.comp = QCompleter(self.model, self); self.comp.setWidget(self)
+        self.comp.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.comp.activated.connect(self.insert_completion); self.comp.popup().installEventFilter(self)
+        self.textEdited.connect(self.update_completions)
+
+    def current_word(self):
+        m = self.word_re.search(self.text(), 0, self.cursorPosition())
+        return m if m and m.group() else None
+
+    def update_completions(self):
+        m = self.current_word(); items = self.index.complete(m.group()) if m else []
+        self.model.setStringList(items)
+        if items and items != [m.group()]: self.comp.complete()
+        else: self.comp.popup().hide()
+
+    def insert_completion(self, word):
+        m = self.current_word(); start, end = (m.start(), m.end()) if m else (self.cursorPosition(),) * 2
+        self.setText(self.text()[:start] + word + self.text()[end:]); self.setCursorPosition(start + len(word))
+
+    def eventFilter(self, obj, event):  # 先于 QCompleter 处理弹窗按键：Tab/回车直接采用当前 (或第一个) 候选
+        popup = self.comp.popup()
+        if obj is popup and event.type() == QEvent.KeyPress and event.key() in (Qt.Key_Tab, Qt.Key_Enter, Qt.Key_Return) and popup.isVisible():
+            index = popup.currentIndex()
+            if not index.isValid(): index = self.model.index(0, 0)
+            self.insert_completion(self.model.data(index)); popup.hide()
+            return True
+        return super().eventFilter(obj, event)
 
 class AutocompleteDelegate(QStyledItemDelegate):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.words = []
-
-    def set_words(self, words):
-        self.words = words
+        self.states, self.idents = CompletionIndex(), CompletionIndex()
 
     def createEditor(self, parent, option, index):
-        if index.column() < 2:
-            editor = TabLineEdit(parent)
-            completer = QCompleter(self.words, editor)
-            completer.setCaseSensitivity(Qt.CaseInsensitive)
-            completer.setCompletionMode(QCompleter.PopupCompletion)
-            editor.setCompleter(completer)
-            return editor
-        return super().createEditor(parent, option, index)
+        if index.column() < 2: return TabLineEdit(parent, self.states, _STATE_WORD_RE)
+        return TabLineEdit(parent, self.idents, _IDENT_WORD_RE)
+
+class DiagramLabel(QLabel):  # 状态图预览：点击位置换算为图像内归一化坐标后发出
+    clicked = Signal(float, float)
+
+    def mousePressEvent(self, event):
+        pix = self.pixmap()
+        if pix is not None and not pix.isNull():
+            x = event.position().x() - (self.width() - pix.width()) / 2
+            y = event.position().y() - (self.height() - pix.height()) / 2
+            if 0 <= x < pix.width() and 0 <= y < pix.height(): self.clicked.emit(x / pix.width(), y / pix.height())
+        super().mousePressEvent(event)
+
+# Verilog 高亮：QSyntaxHighlighter 只对被修改的文本块重新着色；块状态 1 表示仍处于 /* */ 注释内
+VERILOG_KEYWORDS = ("module endmodule input output inout wire reg parameter localparam always assign begin end if else "
+                    "case endcase default posedge negedge initial integer for generate endgenerate function endfunction")
+
+class VerilogHighlighter(QSyntaxHighlighter):
+    TOKEN_RE = re.compile(r"(?P<com>//.*)|(?P<open>/\*)|(?P<str>\"[^\"]*\")|(?P<attr>\(\*.*?\*\))|(?P<sys>\$\w+)"
+                          r"|(?P<num>\b\d*'[sS]?[bBoOdDhH][0-9a-fA-F_xXzZ?]+|\b\d+\b)"
+                          r"|(?P<kw>\b(?:" + "|".join(VERILOG_KEYWORDS.split()) + r")\b)")
+
+    def __init__(self, doc):
+        super().__init__(doc); self.formats = {}
+        for kind, color in (("kw", "#569cd6"), ("num", "#b5cea8"), ("str", "#ce9178"), ("sys", "#dcdcaa"), ("attr", "#c586c0"), ("com", "#6a9955")):
+            f = QTextCharFormat(); f.setForeground(QColor(color)); self.formats[kind] = f
+        self.formats["kw"].setFontWeight(QFont.Bold)
+
+    def highlightBlock(self, text):
+        i, com = 0, self.formats["com"]; self.setCurrentBlockState(0)
+        if self.previousBlockState() == 1:
+            end = text.find("*/")
+            if end < 0: self.setFormat(0, len(text), com); self.setCurrentBlockState(1); return
+            self.setFormat(0, end + 2, com); i = end + 2
+        for m in iter(lambda: self.TOKEN_RE.search(text, i), None):
+            kind, a = m.lastgroup, m.start()
+            if kind == "open":
+                end = text.find("*/", m.end())
+                if end < 0: self.setFormat(a, len(text) - a, com); self.setCurrentBlockState(1); return
+                self.setFormat(a, end + 2 - a, com); i = end + 2; continue
+            self.setFormat(a, m.end() - a, self.formats[kind]); i = m.end()
+
+# 代码预览按段比对：每个 case 分支、输出块、/*== 标题 ==*/ 段各为一段，每段以换行结尾
+_SECTION_RE = re.compile(r"^(?=[ \t]*(?:\w+: begin$|// Output:|/\*==))", re.M)
+
+def code_sections(text):
+    return [p for p in _SECTION_RE.split(text + "\n") if p]
 
 # --- 2. 主窗口 ---
+RENDER_CACHE_SIZE = 32  # 状态图渲染缓存条数 (按 dot 源码区分视图)
+
+# 布局档位 (名称, 引擎, 图属性, 初始 秒/元素)；实测耗时会不断修正每档的速率估计
+LAYOUT_TIERS = (("dot", "dot", {}, 2e-3),
+                ("dot (限迭代)", "dot", {'nslimit': '2', 'nslimit1': '2', 'mclimit': '0.3', 'searchsize': '10', 'remincross': 'false'}, 4e-4),
+                ("sfdp", "sfdp", {'overlap': 'prism', 'splines': 'false', 'outputorder': 'edgesfirst'}, 1e-4))
+SKELETON_RATE, LAYOUT_OVERHEAD = 3e-5, 0.05  # 进程启动等固定开销不计入速率
+
+def skeleton_graph(nodes, pairs):  # 超大图预览：点状节点、去重无标签边
+    g = graphviz.Digraph(format='png', engine='sfdp')
+    g.attr(overlap='prism', splines='false', outputorder='edgesfirst')
+    g.attr('node', shape='point', width='0.06'); g.attr('edge', arrowsize='0.3', color='gray50')
+    for x in nodes: g.node(x)
+    for s, n in dict.fromkeys(pairs): g.edge(s, n)
+    return g
+
+# 边标签：条件 / 动作超过 n 个字符时截断 (n <= 0 不截断)
+def abbrev(text, n):
+    return text if n <= 0 or len(text) <= n else text[:max(n - 1, 1)] + "…"
+
+def edge_label(c, a, n=0):
+    return f"{abbrev(c, n)}\n/ {abbrev(a, n)}" if a else abbrev(c, n)
+
+# 撤销/重做：每条命令只记录变化的行区间 (表格, 起始行, 旧行, 新行)，总单元格数超出预算时丢弃最早的命令
+UNDO_CELL_BUDGET = 2000000
+
+class TableDelta:
+    __slots__ = ("key", "start", "old", "new", "merge")
+    def __init__(self, key, start, old, new, merge=None):
+        self.key, self.start, self.old, self.new, self.merge = key, start, old, new, merge
+
+    def cells(self):
+        return sum(map(len, self.old)) + sum(map(len, self.new)) + 1
+
+def row_delta(key, old, new, merge=None):
+    n, m = len(old), len(new); i = 0; k = min(n, m)
+    while i < k and old[i] == new[i]: i += 1
+    if i == n == m: return None
+    j = 0
+    while j < k - i and old[n - 1 - j] == new[m - 1 - j]: j += 1
+    return TableDelta(key, i, old[i:n - j], new[i:m - j], merge)
+
+class EditHistory:
+    def __init__(self, budget=UNDO_CELL_BUDGET):
+        self.done, self.undone, self.size, self.budget = deque(), [], 0, budget
+
+    def push(self, cmd):
+        self.undone.clear(); last = self.done[-1] if self.done else None
+        # 同一单元格 (或文本编辑中同一行) 的连续修改合并为一条命令
+        if last and len(cmd) == len(last) == 1 and cmd[0].merge is not None:
+            a, b = last[0], cmd[0]
+            if (a.key, a.merge, a.start, len(a.new)) == (b.key, b.merge, b.start, len(b.old)):
+                self.size -= a.cells(); a.new = b.new; self.size += a.cells()
+                if a.old == a.new: self.done.pop(); self.size -= a.cells()
+                return
+        self.done.append(cmd); self.size += sum(d.cells() for d in cmd)
+        while len(self.done) > 1 and self.size > self.budget: self.size -= sum(d.cells() for d in self.done.popleft())
+
+    def undo(self):
+        if not self.done: return None
+        cmd = self.done.pop(); self.size -= sum(d.cells() for d in cmd); self.undone.append(cmd); return cmd
+
+    def redo(self):
+        if not self.undone: return None
+        cmd = self.undone.pop(); self.done.append(cmd); self.size += sum(d.cells() for d in cmd); return cmd
+
 class FSMVisualizerApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -52,11 +241,20 @@ class FSMVisualizerApp(QMainWindow):
         
         self.output_filename = "fsm_render_final"
         self.state_list = []
+        self.coverage = None
+        self.enc_map = {}
+        self.estimates = {}
+        self.entries, self.expanded, self.render_cache, self.view = {}, set(), {}, None
+        self.dsl_rows, self.dsl_loading = None, False; self.model_cache = None
+        self.history, self.shadow = EditHistory(), {"fsm": [], "params": []}
+        self.preview_sections = None
+        self.layout_rate = [r for _, _, _, r in LAYOUT_TIERS] + [SKELETON_RATE]
+        self.graph = GraphIndex()
         self.delegate = AutocompleteDelegate()
         
         self.init_ui()
         self.load_official_example() 
-        self.refresh_logic()
+        self.refresh_logic(); self.shadow = {k: self.read_rows(k) for k in self.shadow}
 
     def init_ui(self):
         main_widget = QWidget()
@@ -85,7 +283,14 @@ class FSMVisualizerApp(QMainWindow):
         self.btn_help.clicked.connect(self.show_help)
         self.btn_info.clicked.connect(self.show_info)
 
-        toolbar.addWidget(btn_save); toolbar.addWidget(btn_load); toolbar.addWidget(btn_gen)
+        self.live_check = QCheckBox("实时预览"); self.live_check.setToolTip("表格修改后自动重新生成代码，只替换变化的段落")
+        self.live_timer = QTimer(self); self.live_timer.setSingleShot(True); self.live_timer.setInterval(300)
+        self.live_timer.timeout.connect(lambda: self.generate_verilog(True))
+        self.view_timer = QTimer(self); self.view_timer.setSingleShot(True); self.view_timer.setInterval(0)
+        self.view_timer.timeout.connect(self.refresh_views)
+        self.live_check.toggled.connect(lambda on: on and self.generate_verilog(True))
+
+        toolbar.addWidget(btn_save); toolbar.addWidget(btn_load); toolbar.addWidget(btn_gen); toolbar.addWidget(self.live_check)
         toolbar.addWidget(self.btn_help); toolbar.addWidget(self.btn_info)
         left_layout.addLayout(toolbar)
 
@@ -100,42 +305,145 @@ class FSMVisualizerApp(QMainWindow):
         cfg_row.addWidget(self.reset_selector, 1)
         cfg_row.addWidget(QLabel("状态编码:"))
         self.encoding_selector = QComboBox()
-        self.encoding_selector.addItems(["Binary", "One-hot", "Gray"])
+        self.encoding_selector.addItems(["Binary", "One-hot", "Gray", "ROM"])
         cfg_row.addWidget(self.encoding_selector, 1)
+        cfg_row.addWidget(QLabel("输出风格:"))
+        self.style_selector = QComboBox()
+        self.style_selector.addItems(["Priority", "Case"])
+        self.style_selector.setToolTip("Priority: 跨状态的 if/else 优先级链\nCase: 先按 case(state) 译码，状态内再判断条件；Moore 型常量输出合并为并行译码项")
+        cfg_row.addWidget(self.style_selector, 1)
+        self.minimize_check = QCheckBox("生成前最小化")
+        cfg_row.addWidget(self.minimize_check)
+        self.module_check = QCheckBox("完整模块"); self.module_check.setToolTip("生成带端口列表与位宽声明的完整 module，端口由条件/动作中的信号推断")
+        cfg_row.addWidget(self.module_check)
         trans_layout.addLayout(cfg_row)
+        timing_row = QHBoxLayout()
+        self.lookahead_check = QCheckBox("前瞻输出")
+        self.lookahead_check.setToolTip("只由所进入状态决定取值的输出改为由 next_state 译码并打拍，与状态同拍更新且无毛刺")
+        timing_row.addWidget(self.lookahead_check)
+        timing_row.addWidget(QLabel("寄存器复制:"))
+        self.dup_edit = QLineEdit(); self.dup_edit.setPlaceholderText("输出:份数, 如 po_en:4")
+        timing_row.addWidget(self.dup_edit, 1)
+        timing_row.addWidget(QLabel("max_fanout:"))
+        self.fanout_spin = QSpinBox(); self.fanout_spin.setRange(0, 100000); self.fanout_spin.setSpecialValueText("不设置")
+        timing_row.addWidget(self.fanout_spin)
+        trans_layout.addLayout(timing_row)
+        self.estimate_label = QLabel(); self.estimate_label.setTextFormat(Qt.RichText)
+        self.estimate_label.setToolTip("解析估算：FF 数 / 4 输入与 6 输入 LUT 数 / 组合逻辑级数，仅供编码选择参考")
+        self.encoding_selector.currentIndexChanged.connect(self.update_estimates)
+        trans_layout.addWidget(self.estimate_label)
 
         self.table = QTableWidget(0, 4)
         self.table.setHorizontalHeaderLabels(["当前状态", "下一状态", "跳转条件", "输出动作"])
         self.table.setItemDelegate(self.delegate)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.table.itemChanged.connect(self.refresh_logic)
+        self.table.itemChanged.connect(lambda item: self.cell_edited("fsm", item))
+        self.table.currentCellChanged.connect(lambda *_: self.paint_graph())
         
         row_ctrl = QHBoxLayout()
         add_btn = QPushButton("添加跳转 (+)"); del_btn = QPushButton("删除选中 (-)")
         add_btn.clicked.connect(lambda: self.add_row())
         del_btn.clicked.connect(self.remove_row)
         row_ctrl.addWidget(add_btn); row_ctrl.addWidget(del_btn)
+        self.undo_btn = QPushButton("撤销"); self.redo_btn = QPushButton("重做")
+        self.undo_btn.clicked.connect(self.undo_edit); self.redo_btn.clicked.connect(self.redo_edit)
+        self.undo_btn.setEnabled(False); self.redo_btn.setEnabled(False)
+        row_ctrl.addWidget(self.undo_btn); row_ctrl.addWidget(self.redo_btn)
+        imp_btn = QPushButton("导入 CSV/TSV"); exp_btn = QPushButton("导出 CSV/TSV")
+        imp_btn.clicked.connect(self.import_table); exp_btn.clicked.connect(self.export_table)
+        row_ctrl.addWidget(imp_btn); row_ctrl.addWidget(exp_btn)
         trans_layout.addWidget(self.table); trans_layout.addLayout(row_ctrl)
         
+        # Tab 1b: 文本编辑 (每行 SRC -> DST : 条件 / 动作，与表格双向同步)
+        dsl_page = QWidget(); dsl_layout = QVBoxLayout(dsl_page)
+        self.dsl_edit = QPlainTextEdit(); self.dsl_edit.setFont(QFont("Consolas", 10)); self.dsl_edit.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.dsl_edit.setPlaceholderText("S_IDLE -> S_ONE : pi_data == DIN_ONE / po_match=0\n# 或 // 开头为注释")
+        self.dsl_edit.textChanged.connect(lambda: None if self.dsl_loading else self.dsl_timer.start())
+        self.dsl_timer = QTimer(self); self.dsl_timer.setSingleShot(True); self.dsl_timer.setInterval(300)
+        self.dsl_timer.timeout.connect(self.apply_dsl)
+        self.dsl_status = QLabel(); self.dsl_status.setWordWrap(True)
+        dsl_layout.addWidget(QLabel("每行一条跳转: 源状态 -> 目标状态 : 条件 / 动作")); dsl_layout.addWidget(self.dsl_edit); dsl_layout.addWidget(self.dsl_status)
+
         # Tab 2: 参数定义
         param_page = QWidget(); param_layout = QVBoxLayout(param_page)
         self.param_table = QTableWidget(0, 3)
         self.param_table.setHorizontalHeaderLabels(["参数名", "数值/位宽", "备注"])
         self.param_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        add_p_btn = QPushButton("添加参数 (+)"); add_p_btn.clicked.connect(self.add_param_row)
+        self.param_table.itemChanged.connect(lambda item: self.cell_edited("params", item))
+        add_p_btn = QPushButton("添加参数 (+)"); add_p_btn.clicked.connect(lambda: self.add_param_row())
+        for table in (self.table, self.param_table):  # Ctrl+V 粘贴电子表格中复制的多行 (制表符分隔)；Ctrl+Z / Ctrl+Y 撤销重做
+            for keys, slot in ((QKeySequence.Paste, lambda _=False, t=table: self.paste_block(t)),
+                               (QKeySequence.Undo, self.undo_edit), (QKeySequence.Redo, self.redo_edit)):
+                act = QAction(table); act.setShortcut(keys); act.setShortcutContext(Qt.WidgetShortcut)
+                act.triggered.connect(slot); table.addAction(act)
         param_layout.addWidget(QLabel("预定义常量参数:")); param_layout.addWidget(self.param_table); param_layout.addWidget(add_p_btn)
 
-        self.design_tabs.addTab(trans_page, "状态转移逻辑"); self.design_tabs.addTab(param_page, "信号参数定义")
+        # Tab 3: 仿真验证
+        sim_page = QWidget(); sim_layout = QVBoxLayout(sim_page)
+        trace_row = QHBoxLayout()
+        trace_row.addWidget(QLabel("Trace 布局:"))
+        self.trace_layout_edit = QLineEdit(); self.trace_layout_edit.setPlaceholderText("信号:位宽, 如 pi_data:1, pi_en:1 (留空则按条件中的输入自动生成)")
+        btn_replay = QPushButton("回放 Trace..."); btn_replay.clicked.connect(self.replay_trace_file)
+        self.vcd_check = QCheckBox("同时导出 VCD")
+        trace_row.addWidget(self.trace_layout_edit, 1); trace_row.addWidget(self.vcd_check); trace_row.addWidget(btn_replay)
+        sim_layout.addLayout(trace_row)
+        tb_row = QHBoxLayout()
+        tb_row.addWidget(QLabel("测试向量数:"))
+        self.tb_vectors = QSpinBox(); self.tb_vectors.setRange(1, 100000000); self.tb_vectors.setValue(10000)
+        self.tb_source = QComboBox(); self.tb_source.addItems(["随机激励", "Trace 文件"])
+        btn_tb = QPushButton("生成 Testbench..."); btn_tb.clicked.connect(self.generate_testbench)
+        btn_graph = QPushButton("可达性分析"); btn_graph.clicked.connect(self.show_analysis)
+        btn_min = QPushButton("等价状态分析"); btn_min.clicked.connect(self.show_minimization)
+        tb_row.addWidget(self.tb_vectors, 1); tb_row.addWidget(self.tb_source); tb_row.addWidget(btn_tb)
+        tb_row.addWidget(btn_graph); tb_row.addWidget(btn_min)
+        sim_layout.addLayout(tb_row)
+        enc_row = QHBoxLayout()
+        enc_row.addWidget(QLabel("编码搜索预算(秒):"))
+        self.enc_budget = QDoubleSpinBox(); self.enc_budget.setRange(0.2, 600.0); self.enc_budget.setValue(2.0)
+        btn_enc = QPushButton("搜索最优编码"); btn_enc.clicked.connect(self.search_encoding)
+        enc_row.addWidget(self.enc_budget, 1); enc_row.addWidget(btn_enc)
+        sim_layout.addLayout(enc_row)
+        dec_row = QHBoxLayout()
+        dec_row.addWidget(QLabel("最多子状态机:"))
+        self.dec_parts = QSpinBox(); self.dec_parts.setRange(2, 32); self.dec_parts.setValue(8)
+        btn_dec = QPushButton("自动分解"); btn_dec.clicked.connect(self.decompose)
+        dec_row.addWidget(self.dec_parts, 1); dec_row.addWidget(btn_dec)
+        sim_layout.addLayout(dec_row)
+        self.sim_log = QTextEdit(); self.sim_log.setReadOnly(True)
+        sim_layout.addWidget(QLabel("仿真日志:")); sim_layout.addWidget(self.sim_log)
+
+        self.design_tabs.addTab(trans_page, "状态转移逻辑"); self.design_tabs.addTab(dsl_page, "文本编辑"); self.design_tabs.addTab(param_page, "信号参数定义")
+        self.design_tabs.currentChanged.connect(lambda k: self.load_dsl() if self.design_tabs.widget(k) is dsl_page else None)
+        self.design_tabs.addTab(sim_page, "仿真验证")
         left_layout.addWidget(self.design_tabs)
 
         # --- 右侧：预览区 ---
         right_widget = QWidget(); right_layout = QVBoxLayout(right_widget)
-        self.graph_label = QLabel("正在生成状态图..."); self.graph_label.setAlignment(Qt.AlignCenter)
+        self.graph_label = DiagramLabel("正在生成状态图..."); self.graph_label.setAlignment(Qt.AlignCenter)
+        self.graph_label.clicked.connect(self.select_from_diagram)
         self.graph_label.setStyleSheet("border: 1px solid #ddd; background: white;")
-        self.code_preview = QTextEdit(); self.code_preview.setFont(QFont("Consolas", 10))
+        self.code_preview = QPlainTextEdit(); self.code_preview.setFont(QFont("Consolas", 10))
         self.code_preview.setStyleSheet("background-color: #1e1e1e; color: #dcdcdc;")
+        self.code_preview.setLineWrapMode(QPlainTextEdit.NoWrap); self.code_preview.setUndoRedoEnabled(False)
+        self.highlighter = VerilogHighlighter(self.code_preview.document())
 
-        right_layout.addWidget(QLabel("可视化状态转移图:")); right_layout.addWidget(self.graph_label, 3)
+        graph_row = QHBoxLayout(); graph_row.addWidget(QLabel("可视化状态转移图:")); graph_row.addStretch(1)
+        self.heatmap_check = QCheckBox("覆盖率热力图"); self.heatmap_check.toggled.connect(self.draw_fsm)
+        graph_row.addWidget(self.heatmap_check)
+        self.bundle_check = QCheckBox("合并平行边"); self.bundle_check.setToolTip("同一对状态间的多条跳转画成一条边，条件列入图例")
+        self.bundle_check.toggled.connect(self.draw_fsm); graph_row.addWidget(self.bundle_check)
+        self.label_spin = QSpinBox(); self.label_spin.setRange(0, 200); self.label_spin.setSpecialValueText("标签不截断")
+        self.label_spin.setSuffix(" 字"); self.label_spin.setToolTip("边标签中条件/动作超过此长度时截断")
+        self.label_spin.valueChanged.connect(self.draw_fsm); graph_row.addWidget(self.label_spin)
+        self.layout_budget = QDoubleSpinBox(); self.layout_budget.setRange(0.5, 600); self.layout_budget.setValue(5)
+        self.layout_budget.setPrefix("布局预算 "); self.layout_budget.setSuffix(" s")
+        self.layout_budget.setToolTip("按规模自动选择布局引擎：小图 dot，中等图限制 dot 迭代次数，大图 sfdp，仍超预算时只画骨架")
+        graph_row.addWidget(self.layout_budget)
+        btn_fold = QPushButton("展开/折叠超状态"); btn_fold.setToolTip("展开或折叠表格中选中状态所属的超状态 (名称以 '.' 分层)")
+        btn_fold.clicked.connect(self.toggle_super); graph_row.addWidget(btn_fold)
+        btn_export = QPushButton("导出状态图"); btn_export.setToolTip("导出 SVG / PDF，或分块渲染任意尺寸的 PNG，可按层次或连通分量分页")
+        btn_export.clicked.connect(self.export_diagram_file); graph_row.addWidget(btn_export)
+        right_layout.addLayout(graph_row); right_layout.addWidget(self.graph_label, 3)
         right_layout.addWidget(QLabel("Verilog 代码预览:")); right_layout.addWidget(self.code_preview, 2)
         main_layout.addWidget(left_widget, 1); main_layout.addWidget(right_widget, 1)
 
@@ -144,14 +452,31 @@ class FSMVisualizerApp(QMainWindow):
         item = table.item(row, col)
         return item.text() if item else ""
 
+    def current_model(self):
+        if self.model_cache is not None: return self.model_cache  # 一次 refresh_logic 内共用同一模型
+        f = [[self.safe_get_text(self.table, i, j) for j in range(4)] for i in range(self.table.rowCount())]
+        p = [[self.safe_get_text(self.param_table, i, j) for j in range(3)] for i in range(self.param_table.rowCount())]
+        return FSMModel(f, p, self.reset_selector.currentText(), self.encoding_selector.currentText(), self.enc_map,
+                        self.style_selector.currentText(), self.timing_options(), self.entries)
+
+    def timing_options(self):
+        dup = {}
+        for part in self.dup_edit.text().replace(';', ',').split(','):
+            name, _, n = part.partition(':')
+            if name.strip() and n.strip().isdigit(): dup[name.strip()] = int(n)
+        return {"lookahead": self.lookahead_check.isChecked(), "dup": dup, "max_fanout": self.fanout_spin.value()}
+
     # --- 功能函数 ---
     def show_help(self):
         help_text = """
         <h3>FSM 工具使用帮助</h3>
         <b>1. 逻辑输入:</b>
         <ul>
-            <li><b>当前/下一状态:</b> 直接输入状态名，或在此基础上点击键盘上下选中，按 <b>Tab</b> 自动补全。</li>
+            <li><b>当前/下一状态:</b> 直接输入状态名，或在此基础上点击键盘上下选中，按 <b>Tab</b> 自动补全；条件与动作列同样可补全信号名、参数名和已用过的输出，输入不连续的字母 (如 <i>pdt</i> → <i>pi_data</i>) 也能匹配。</li>
             <li><b>跳转条件:</b> 输入 Verilog 语法条件，如 <i>pi_data == 1'b1</i>。</li>
+            <li><b>计数等待:</b> 条件中写 <i>wait(1000)</i> 表示在当前状态停留满 1000 个周期，可与其他条件组合，如 <i>wait(1000) || done</i>；生成代码共用一个递减计数器。</li>
+            <li><b>层次状态:</b> 状态名用 <i>.</i> 分层，如 <i>INIT.WAIT_CLK</i>；写在超状态 <i>INIT</i> 上的跳转对其全部子状态生效，跳入超状态即进入第一个子状态。状态图中超状态默认折叠，可用“展开/折叠超状态”查看。</li>
+            <li><b>文本编辑:</b> “文本编辑”页中每行写一条跳转 <i>S_IDLE -> S_ONE : pi_data == 1 / po_en=1</i>，停止输入后自动同步到表格；语法错误的行标红波浪线，修正前表格不更新。</li>
             <li><b>输出动作:</b> 格式为 <i>变量名=值</i>，多个动作逗号隔开，如 <i>po_vld=1, po_data=8'hFF</i>。</li>
         </ul>
         <b>2. 状态编码:</b>
@@ -159,11 +484,20 @@ class FSMVisualizerApp(QMainWindow):
             <li><b>Binary:</b> 普通二进制编码。</li>
             <li><b>One-hot:</b> 独热码（每个状态一位）。</li>
             <li><b>Gray:</b> 格雷码（相邻状态仅一位变化）。</li>
+            <li><b>ROM:</b> 查表实现，次态与输出写入 $readmemh 初始化的 Block RAM，适合状态多、跳转与输入关系简单的大状态机。</li>
+            <li><b>Optimized:</b> 在“仿真验证”页搜索得到的编码，按实际跳转（及仿真覆盖率）最小化翻转位数。</li>
         </ul>
         <b>3. 技巧:</b>
         <ul>
             <li>同一状态下相同跳转条件会显示为<span style='color:red;'>红色</span>表示冲突。</li>
+            <li>勾选 <b>完整模块</b> 后生成带端口列表的 module：输入/输出端口及位宽由条件与动作中的信号、常量位宽和参数自动推断。</li>
             <li>生成的 Verilog 采用全时序打拍输出，不是经典的三段式状态机</li>
+            <li>勾选 <b>前瞻输出</b> 后，只由所进入状态决定的输出改由 next_state 译码；高扇出输出可在“寄存器复制”中填写份数。</li>
+            <li>跳转很密时勾选 <b>合并平行边</b>：同一对状态间的多行合成一条编号边，条件列在图例中；标签长度可限制截断，布局明显加快。</li>
+            <li>状态图按规模自动选择布局引擎，超过 <b>布局预算</b> 时逐级简化 (限迭代 dot → sfdp → 骨架图)；鼠标停在图上可查看本次所用方式与耗时。</li>
+            <li>点击状态图中的节点或连线会选中并滚动到表格中对应的行；反之表格当前行对应的连线在图中以红色标出。</li>
+            <li><b>导出状态图</b> 可输出 SVG / PDF 或任意尺寸的 PNG (分块渲染)，并可按顶层超状态或连通分量分页，便于评审文档使用。</li>
+            <li>输出风格选 <b>Case</b> 时先按 case(state) 译码再判断条件，适合状态和行数较多的大状态机。</li>
         </ul>
         <b>4. 注意:</b>
         <ul>
@@ -177,36 +511,84 @@ class FSMVisualizerApp(QMainWindow):
         QMessageBox.about(self, "项目信息", "<b>名称:</b> FPGA 可视化状态机设计工具<br><b>版本:</b> V1.0.0 (正式版)<br><b>开发者:</b> Gemini (Google) & Kevin_Quinn_Cat<br><b>年份:</b> 2026.2<br><b>维护:</b> Kevin_Quinn_Cat@outlook.com")
 
     def load_official_example(self):
-        self.table.setRowCount(0); self.param_table.setRowCount(0)
-        self.add_param_row("DIN_ZERO", "1'b0", "Input 0"); self.add_param_row("DIN_ONE", "1'b1", "Input 1")
+        self.fill_table(self.param_table, [("DIN_ZERO", "1'b0", "Input 0"), ("DIN_ONE", "1'b1", "Input 1")])
         ex = [("S_IDLE", "S_ONE", "pi_data == DIN_ONE", "po_match=0"),
               ("S_IDLE", "S_IDLE", "pi_data == DIN_ZERO", "po_match=0"),
               ("S_ONE", "S_TEN", "pi_data == DIN_ZERO", "po_match=0"),
               ("S_ONE", "S_ONE", "pi_data == DIN_ONE", "po_match=0"),
               ("S_TEN", "S_IDLE", "pi_data == DIN_ONE", "po_match=1"),
               ("S_TEN", "S_IDLE", "pi_data == DIN_ZERO", "po_match=0")]
-        self.table.blockSignals(True)
-        for s, n, c, a in ex: self.add_row(s, n, c, a)
-        self.table.blockSignals(False)
+        self.fill_table(self.table, ex)
 
     def add_row(self, s="IDLE", n="IDLE", c="1", a=""):
         self.table.blockSignals(True)
         r = self.table.rowCount(); self.table.insertRow(r)
         self.table.setItem(r,0,QTableWidgetItem(s)); self.table.setItem(r,1,QTableWidgetItem(n))
         self.table.setItem(r,2,QTableWidgetItem(c)); self.table.setItem(r,3,QTableWidgetItem(a))
-        self.table.blockSignals(False); self.refresh_logic()
+        self.table.blockSignals(False); self.record({"fsm": self.shadow["fsm"] + [self.read_row("fsm", r)]}); self.refresh_logic()
 
     def remove_row(self):
         curr = self.table.currentRow()
-        if curr >= 0: self.table.removeRow(curr); self.refresh_logic()
+        if curr >= 0:
+            rows = self.shadow["fsm"]; self.table.removeRow(curr); self.graph.remove_row(curr)
+            self.record({"fsm": rows[:curr] + rows[curr + 1:]}); self.refresh_logic()
 
     def add_param_row(self, name="NAME", val="0", note=""):
+        self.param_table.blockSignals(True)
         r = self.param_table.rowCount(); self.param_table.insertRow(r)
         self.param_table.setItem(r,0,QTableWidgetItem(name))
         self.param_table.setItem(r,1,QTableWidgetItem(val))
         self.param_table.setItem(r,2,QTableWidgetItem(note))
+        self.param_table.blockSignals(False); self.record({"params": self.shadow["params"] + [self.read_row("params", r)]})
+        self.update_estimates(); self.sync_completions()
+
+    # --- 撤销/重做：shadow 保存两张表上一次提交后的内容，据此算出只含变化行的增量命令 ---
+    def table_of(self, key):
+        return self.table if key == "fsm" else self.param_table
+
+    def read_row(self, key, i):  # 按表格中实际的文本记录，而不是调用方传入的参数
+        t = self.table_of(key); return tuple(self.safe_get_text(t, i, j) for j in range(t.columnCount()))
+
+    def read_rows(self, key):
+        return [self.read_row(key, i) for i in range(self.table_of(key).rowCount())]
+
+    def record(self, changes, merge=None):
+        cmd = []
+        for key, rows in changes.items():
+            cols = self.table_of(key).columnCount(); rows = [tuple((list(r) + [""] * cols)[:cols]) for r in rows]
+            d = row_delta(key, self.shadow[key], rows, merge); self.shadow[key] = rows
+            if d: cmd.append(d)
+        if cmd: self.history.push(cmd)
+        self.undo_btn.setEnabled(bool(self.history.done)); self.redo_btn.setEnabled(bool(self.history.undone))
+
+    def cell_edited(self, key, item):
+        r, c = item.row(), item.column(); rows = self.shadow[key]
+        if r < len(rows) and rows[r][c] != item.text():
+            row = list(rows[r]); row[c] = item.text(); self.record({key: rows[:r] + [tuple(row)] + rows[r + 1:]}, (r, c))
+        if key == "fsm": self.refresh_logic()
+        else: self.update_estimates(); self.sync_completions()
+
+    def apply_history(self, cmd, forward):
+        for d in (cmd if forward else reversed(cmd)):
+            rows, cut, put = self.shadow[d.key], (d.old if forward else d.new), (d.new if forward else d.old)
+            rows = rows[:d.start] + put + rows[d.start + len(cut):]; self.shadow[d.key] = rows
+            # 变化区间以前的行不动；行数不变时只重写区间本身
+            self.fill_table(self.table_of(d.key), rows, d.start, d.start + len(put) if len(put) == len(cut) else None)
+        keys = {d.key for d in cmd}
+        if "params" in keys: self.update_estimates(); self.sync_completions()
+        if "fsm" in keys: self.refresh_logic()
+        self.undo_btn.setEnabled(bool(self.history.done)); self.redo_btn.setEnabled(bool(self.history.undone))
 
-    def refresh_logic(self):
+    def undo_edit(self):
+        cmd = self.history.undo()
+        if cmd: self.apply_history(cmd, False)
+
+    def redo_edit(self):
+        cmd = self.history.redo()
+        if cmd: self.apply_history(cmd, True)
+
+    # defer=True 用于粘贴/导入等整表更新：表格与冲突标记立即刷新，补全词库、资源估算和状态图合并到下一次事件循环再做
+    def refresh_logic(self, defer=False):
         self.table.blockSignals(True)
         try:
             states = set()
@@ -215,21 +597,128 @@ class FSMVisualizerApp(QMainWindow):
                 if s: states.add(s)
                 if n: states.add(n)
             self.state_list = sorted(list(states))
-            self.delegate.set_words(self.state_list)
+            self.delegate.states.sync(self.state_list)
             cur_reset = self.reset_selector.currentText()
             self.reset_selector.blockSignals(True); self.reset_selector.clear(); self.reset_selector.addItems(self.state_list)
             if cur_reset in self.state_list: self.reset_selector.setCurrentText(cur_reset)
-            self.reset_selector.blockSignals(False)
-            self.check_conflicts(); self.draw_fsm()
-        finally: self.table.blockSignals(False)
+            self.reset_selector.blockSignals(False); self.model_cache = self.current_model()
+            self.graph.sync([(s, n) for s, n, _, _ in self.model_cache.rows])
+            self.check_conflicts(); self.highlight_analysis()
+            if defer: self.view_timer.start()
+            else: self.view_timer.stop(); self.refresh_views()
+            if self.live_check.isChecked(): self.live_timer.start()
+        finally: self.model_cache = None; self.table.blockSignals(False)
 
-    def check_conflicts(self):
-        cmap = {}
+    def refresh_views(self):
+        self.sync_completions(); self.update_estimates(); self.draw_fsm()
+
+    def sync_completions(self):
+        ids = {self.safe_get_text(self.param_table, i, 0).strip() for i in range(self.param_table.rowCount())}
         for i in range(self.table.rowCount()):
+            ids.update(cell_identifiers(self.safe_get_text(self.table, i, 2)))
+            ids.update(cell_identifiers(self.safe_get_text(self.table, i, 3), True))
+        self.delegate.idents.sync(ids)
+
+    # --- 批量写入表格：只改动变化的单元格，最后统一刷新一次 ---
+    def fill_table(self, table, rows, start=0, stop=None):
+        cols = table.columnCount(); table.blockSignals(True); table.setUpdatesEnabled(False)
+        try:
+            table.setRowCount(len(rows))
+            for i in range(start, len(rows) if stop is None else stop):
+                r = rows[i]
+                for j in range(cols):
+                    text = r[j] if j < len(r) else ""; item = table.item(i, j)
+                    if item is None: table.setItem(i, j, QTableWidgetItem(text))
+                    elif item.text() != text: item.setText(text)
+        finally: table.setUpdatesEnabled(True); table.blockSignals(False)
+
+    def set_table_rows(self, rows, refresh=True, merge=None, defer=False):
+        self.fill_table(self.table, rows); self.record({"fsm": rows}, merge)
+        if refresh: self.refresh_logic(defer)
+
+    def set_param_rows(self, rows, refresh=True):
+        self.fill_table(self.param_table, rows); self.record({"params": rows})
+        if refresh: self.update_estimates(); self.sync_completions()
+
+    def paste_block(self, table):
+        block = parse_delimited(QApplication.clipboard().text(), "\t")
+        if not block: return
+        cols = table.columnCount(); r0, c0 = max(table.currentRow(), 0), max(table.currentColumn(), 0)
+        rows = [list(r) for r in self.shadow["fsm" if table is self.table else "params"]]  # shadow 与表格内容一致，不必逐格读回
+        rows += [[""] * cols for _ in range(r0 + len(block) - len(rows))]
+        for k, vals in enumerate(block): rows[r0 + k][c0:c0 + len(vals)] = vals[:cols - c0]
+        if table is self.table: self.set_table_rows(rows, defer=True)
+        else: self.set_param_rows(rows)
+        table.setCurrentCell(r0, c0)
+
+    def import_table(self):
+        path, _ = QFileDialog.getOpenFileName(self, "导入跳转表", "", "表格 (*.csv *.tsv *.txt);;All (*)")
+        if not path: return
+        try: rows = read_table_file(path)
+        except (OSError, UnicodeDecodeError) as e: QMessageBox.warning(self, "导入失败", str(e)); return
+        self.set_table_rows(rows, defer=True); self.sim_log.append(f"[导入] {os.path.basename(path)}: {len(rows)} 行")
+
+    def export_table(self):
+        path, _ = QFileDialog.getSaveFileName(self, "导出跳转表", "fsm.csv", "CSV (*.csv);;TSV (*.tsv)")
+        if path: write_table_file(path, self.table_rows())
+
+    # --- 文本编辑模式：逐行解析结果按行文本缓存，停止输入 300ms 后整体比对并同步到表格 ---
+    def load_dsl(self):
+        rows = self.table_rows()
+        if rows == self.dsl_rows: return
+        self.dsl_loading = True
+        try: self.dsl_edit.setPlainText("\n".join(format_dsl_line(r) for r in rows))
+        finally: self.dsl_loading = False
+        self.dsl_rows = rows; self.dsl_edit.setExtraSelections([]); self.dsl_status.setText(f"共 {len(rows)} 条跳转")
+
+    def apply_dsl(self):
+        rows, errs = [], []
+        for k, line in enumerate(self.dsl_edit.toPlainText().split("\n")):
+            r, e = parse_dsl_line(line)
+            if e: errs.append((k, e))
+            elif r: rows.append(r)
+        marks = []
+        for k, _ in errs[:500]:
+            sel = QTextEdit.ExtraSelection(); sel.cursor = QTextCursor(self.dsl_edit.document().findBlockByNumber(k))
+            sel.format.setUnderlineStyle(QTextCharFormat.WaveUnderline); sel.format.setUnderlineColor(QColor(220, 0, 0))
+            sel.format.setProperty(QTextFormat.FullWidthSelection, True); marks.append(sel)
+        self.dsl_edit.setExtraSelections(marks)
+        if errs:
+            self.dsl_status.setText(f"<span style='color:red'>{len(errs)} 行有语法错误，表格未更新。</span> "
+                                    + "; ".join(f"第 {k + 1} 行: {e}" for k, e in errs[:3])); return
+        self.dsl_status.setText(f"共 {len(rows)} 条跳转")
+        if rows != self.table_rows(): self.set_table_rows(rows, merge="dsl")
+        self.dsl_rows = rows
+
+    # --- 资源估算：所有编码一次算完，表格内容不变时复用结果 ---
+    def update_estimates(self):
+        model = self.current_model(); cur = self.encoding_selector.currentText()
+        modes = [self.encoding_selector.itemText(i) for i in range(self.encoding_selector.count())]
+        key = (tuple(model.rows), tuple(model.params), tuple(sorted(self.enc_map.items())), tuple(modes))
+        est = self.estimates.pop(key, None)  # 按内容缓存最近几次结果，撤销回到旧版本时直接复用
+        if est is None:
+            try:
+                est = estimate_resources(model, [m for m in modes if m != "ROM"]) if model.state_list else {}
+                if est and "ROM" in modes:
+                    widths = infer_signal_widths(model)
+                    outs = model.outputs()  # 估算只需位宽，不必编译仿真器
+                    est["ROM"] = rom_layout(model.state_list, [(n, widths.get(n, 1)) for n in model.inputs()], outs, [widths.get(n, 1) for n in outs])
+            except Exception: est = {}
+        self.estimates[key] = est
+        if len(self.estimates) > RENDER_CACHE_SIZE: self.estimates.pop(next(iter(self.estimates)))
+        cells = []
+        for mode, e in est.items():
+            if mode == "ROM": text = f"ROM: 2^{e.aw} × {e.dw} bit"
+            else: text = f"{mode}: FF {e['ff']} · LUT4 {e['lut4']}/{e['depth4']}级 · LUT6 {e['lut6']}/{e['depth6']}级"
+            cells.append(f"<b style='color:#0b5ed7'>{text}</b>" if mode == cur else f"<span style='color:gray'>{text}</span>")
+        self.estimate_label.setText("资源估算 — " + " &nbsp;|&nbsp; ".join(cells) if cells else "")
+
+    def check_conflicts(self):
+        cmap, white, red = {}, QColor(255, 255, 255), QColor(255, 200, 200)  # 颜色只构造一次，整表逐格设置时开销明显
+        for i, (s, _, c, _) in enumerate(self.current_model().tree_rows):
             for j in range(4): 
                 it = self.table.item(i,j)
-                if it: it.setBackground(QColor(255,255,255))
-            s, c = self.safe_get_text(self.table, i, 0), self.safe_get_text(self.table, i, 2)
+                if it: it.setBackground(white)
             if s and c:
                 key = (s, c); cmap.setdefault(key, []).append(i)
         for rows in cmap.values():
@@ -237,96 +726,2023 @@ class FSMVisualizerApp(QMainWindow):
                 for r in rows:
                     for col in range(4): 
                         item = self.table.item(r,col)
-                        if item: item.setBackground(QColor(255,200,200))
+                        if item: item.setBackground(red)
 
-    def draw_fsm(self):
-        dot = graphviz.Digraph(format='png'); dot.attr(rankdir='LR', fontname='Microsoft YaHei')
-        res = self.reset_selector.currentText(); has_content = False
-        for i in range(self.table.rowCount()):
-            s, n = self.safe_get_text(self.table, i, 0), self.safe_get_text(self.table, i, 1)
-            c, a = self.safe_get_text(self.table, i, 2), self.safe_get_text(self.table, i, 3)
-            if s and n:
-                dot.edge(s, n, label=f"{c}\n/ {a}" if a else c, fontname='Microsoft YaHei')
-                has_content = True
-        for state in self.state_list:
-            if state == res: dot.node(state, shape='doublecircle', color='darkgreen', style='filled', fillcolor='honeydew')
-            else: dot.node(state, shape='circle', style='filled', fillcolor='lightblue')
-        if not has_content: return
+    # --- 图分析：不可达 / 死状态 / 陷阱强连通分量标注 ---
+    def analysis(self):
+        model = self.current_model()
+        return self.graph.analyze(model.state_list, model.reset)
+
+    def highlight_analysis(self):
+        rep = self.analysis(); bad = {}; gray, orange, ok = QColor(150, 150, 150), QColor(200, 110, 0), (QColor(0, 0, 0), "")
+        for st in rep.unreachable: bad[st] = (gray, "从复位状态不可达")
+        for st in rep.sinks: bad[st] = (orange, "死状态: 进入后无法离开")
+        for comp in rep.traps:
+            for st in comp: bad.setdefault(st, (orange, "陷阱: 所在强连通分量无出口"))
+        # 覆盖率与分析结果合并在同一提示中；修改字体颜色/提示会触发 itemChanged，期间屏蔽信号
+        cov = self.current_coverage(); hits = self.table_row_hits(cov) if cov else []
+        blocked = self.table.blockSignals(True)
         try:
-            dot.render(self.output_filename, cleanup=True)
+            for i, row in enumerate(self.current_model().tree_rows):
+                color, tip = bad.get(hier_flat(row[0]), ok)
+                if i < len(hits): tip = "\n".join(filter(None, (tip, f"覆盖: {hits[i]} 次 ({100.0 * hits[i] / max(cov.cycles, 1):.2f}%)")))
+                for j in range(4):
+                    item = self.table.item(i, j)
+                    if item: item.setForeground(color); item.setToolTip(tip)
+        finally: self.table.blockSignals(blocked)
+
+    def analysis_node_attrs(self, state, rep):
+        if state in rep.unreachable: return {'fillcolor': 'gainsboro', 'fontcolor': 'gray40', 'style': 'filled,dashed'}
+        if state in rep.sinks or any(state in c for c in rep.traps): return {'fillcolor': 'orange'}
+        return {}
+
+    def show_analysis(self):
+        rep = self.analysis()
+        self.sim_log.append("\n".join(rep.report()))
+        self.highlight_analysis(); self.draw_fsm()
+
+    # --- 状态图：超状态默认折叠为单个节点，只布局可见部分；同一视图的渲染结果按 dot 源码缓存 ---
+    def table_rows(self):
+        return [tuple(self.safe_get_text(self.table, i, j) for j in range(4)) for i in range(self.table.rowCount())]
+
+    def draw_fsm(self):
+        rep = self.analysis()
+        d = diagram_graph(self.table_rows(), self.reset_selector.currentText(), self.expanded, self.entries, self.bundle_check.isChecked(),
+                          self.label_spin.value(), self.coverage_heat(), lambda state: self.analysis_node_attrs(hier_flat(state), rep))
+        if not d.edges: return
+        shot = self.render_cache.pop(d.dot.source, None)
+        if shot is None:
+            shot = self.render_graph(d.dot, d.nodes, [(vs, vn) for vs, vn, _ in d.edges])
+            if shot is None: return
+        self.render_cache[d.dot.source] = shot
+        if len(self.render_cache) > RENDER_CACHE_SIZE: self.render_cache.pop(next(iter(self.render_cache)))
+        rows_of, key_of = {}, {}
+        for vs, vn, rows in d.edges:
+            rows_of.setdefault(("edge", vs, vn), []).extend(rows); rows_of.setdefault(("node", vs), []).extend(rows)
+            key_of.update((i, ("edge", vs, vn)) for i in rows)
+        for i, vs in d.hidden.items(): rows_of.setdefault(("node", vs), []).append(i); key_of[i] = ("node", vs)
+        self.view = (*shot, rows_of, key_of); self.paint_graph()
+
+    # --- 图表联动：点击图元选中对应表格行；当前行对应的边 (或所在折叠节点) 在图上描红 ---
+    def paint_graph(self):
+        if not self.view: return
+        pix, index, _, key_of = self.view
+        out = pix.scaled(self.graph_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        shapes = index.shapes.get(key_of.get(self.table.currentRow()), ()) if index else ()
+        if shapes:
+            painter = QPainter(out); painter.setPen(QPen(QColor(220, 0, 0), 3))
+            for _, box, ax, ay, bx, by in shapes:
+                (u1, v1), (u2, v2) = index.to_image(ax, ay), index.to_image(bx, by)
+                a, b = QPointF(u1 * out.width(), v1 * out.height()), QPointF(u2 * out.width(), v2 * out.height())
+                if box: painter.drawRect(QRectF(a, b).normalized())
+                else: painter.drawLine(a, b)
+            painter.end()
+        self.graph_label.setPixmap(out)
+
+    def select_from_diagram(self, u, v):
+        if not self.view or not self.view[1]: return
+        rows = self.view[2].get(self.view[1].hit(u, v), [])
+        if not rows: return
+        self.table.setCurrentCell(rows[0], 0); sel = QItemSelection()
+        for r in rows: sel.select(self.table.model().index(r, 0), self.table.model().index(r, 3))
+        self.table.selectionModel().select(sel, QItemSelectionModel.ClearAndSelect)
+        self.table.scrollToItem(self.table.item(rows[0], 0))
+
+    # --- 布局引擎：按图规模与实测耗时选择预算内最精细的一档，超时则逐档降级，最后退到骨架图 ---
+    def render_graph(self, dot, nodes, pairs):
+        size, budget = len(nodes) + len(pairs), self.layout_budget.value(); t0 = time.perf_counter()
+        skel = len(LAYOUT_TIERS)
+        tier = next((t for t in range(skel) if LAYOUT_OVERHEAD + self.layout_rate[t] * size <= budget), skel)
+        for t in range(tier, skel + 1):
+            g = skeleton_graph(nodes, pairs) if t == skel else dot.copy()
+            if t < skel: g.engine = LAYOUT_TIERS[t][1]; g.attr(**LAYOUT_TIERS[t][2])
+            left = budget - (time.perf_counter() - t0) - (LAYOUT_OVERHEAD + self.layout_rate[skel] * size if t < skel else 0)
+            t1 = time.perf_counter()
+            try:
+                subprocess.run([g.engine, f"-T{g.format}", "-o", f"{self.output_filename}.png", "-Tjson0", "-o", f"{self.output_filename}.json"],
+                               input=g.source.encode('utf-8'), capture_output=True, check=True, timeout=max(left, 0.1))
+            except subprocess.TimeoutExpired: self.layout_rate[t] = max(self.layout_rate[t] * 2, budget / max(size, 1)); continue
+            except (OSError, subprocess.CalledProcessError): return None
+            dt = time.perf_counter() - t1; self.layout_rate[t] = 0.7 * self.layout_rate[t] + 0.3 * max(dt - LAYOUT_OVERHEAD, 0) / max(size, 1)
             pix = QPixmap(f"{self.output_filename}.png")
-            if not pix.isNull(): self.graph_label.setPixmap(pix.scaled(self.graph_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation))
-        except: pass
+            self.graph_label.setToolTip(f"布局: {LAYOUT_TIERS[t][0] if t < skel else '骨架图'}, {len(nodes)} 个节点 / {len(pairs)} 条边, {dt:.2f}s")
+            try:
+                with open(f"{self.output_filename}.json", 'r', encoding='utf-8') as f_in: index = DiagramIndex(json.load(f_in))
+            except (OSError, ValueError, KeyError): index = None
+            return None if pix.isNull() else (pix, index)
+        self.graph_label.setToolTip(f"布局超出预算 {budget:g}s，已放弃渲染"); return None
+
+    def export_diagram_file(self):
+        path, _ = QFileDialog.getSaveFileName(self, "导出状态图", "fsm.svg", "SVG (*.svg);;PDF (*.pdf);;PNG (*.png)")
+        if not path: return
+        modes = {"单页": "none", "按层次分页": "hierarchy", "按连通分量分页": "components"}
+        mode, ok = QInputDialog.getItem(self, "导出状态图", "分页方式:", list(modes), 0, False)
+        if not ok: return
+        scale = 1.0
+        if path.lower().endswith(".png"):
+            scale, ok = QInputDialog.getDouble(self, "导出状态图", "缩放倍数 (1 = 72 dpi，分块渲染不受尺寸限制):", 4.0, 0.1, 100.0, 1)
+            if not ok: return
+        progress, tick = self.progress_dialog("正在导出状态图...")
+        try: paths = export_diagram(self.table_rows(), path, self.reset_selector.currentText(), modes[mode], self.expanded, self.entries,
+                                    scale, bundle=self.bundle_check.isChecked(), cut=self.label_spin.value(), progress=tick)
+        except (OSError, ValueError, subprocess.CalledProcessError) as e: QMessageBox.warning(self, "导出失败", str(e)); return
+        finally: progress.close()
+        self.sim_log.append("[状态图] 已导出 " + (", ".join(paths) or "(无跳转，未生成文件)"))
+
+    def toggle_super(self):
+        i = max(self.table.currentRow(), 0); j = self.table.currentColumn() if self.table.currentColumn() in (0, 1) else 0
+        name = self.safe_get_text(self.table, i, j); chain = hier_parents(name) + ([name] if name in hier_tree(self.state_list) else [])
+        sup = next((p for p in chain if p not in self.expanded), None)
+        if sup: self.expanded.add(sup)
+        elif chain: self.expanded.discard(chain[-1])
+        self.draw_fsm()
+
+    # --- 覆盖率：热力图着色与逐行报告 ---
+    def current_coverage(self):
+        if not self.coverage: return None
+        rows, cov, _ = self.coverage
+        return cov if rows == self.current_model().rows else None
+
+    def table_row_hits(self, cov):  # 展平后的行命中数按来源表格行汇总
+        hits = [0] * self.table.rowCount()
+        for r, h in zip(self.coverage[2], cov.row_hits):
+            if r < len(hits): hits[r] += h
+        return hits
+
+    def coverage_heat(self):
+        cov = self.current_coverage() if self.heatmap_check.isChecked() else None
+        if not cov: return None
+        hits = self.table_row_hits(cov); peak_r, peak_s = max(hits, default=0), max(cov.state_hits, default=0)
+        nodes = {st: {'fillcolor': heat_color(h, peak_s)} for st, h in zip(cov.states, cov.state_hits)}
+        edges = [{'color': heat_color(h, peak_r), 'penwidth': f"{1 + 3 * heat_level(h, peak_r):.2f}",
+                  'style': 'solid' if h else 'dashed'} for h in hits]
+        return nodes, edges
 
-    def generate_verilog(self):
+    def show_coverage(self, model, cov):
+        self.coverage = (model.rows, cov, model.origin)
+        self.sim_log.append("\n".join(coverage_report(model, cov))); self.highlight_analysis()
+        if self.heatmap_check.isChecked(): self.draw_fsm()
+        else: self.heatmap_check.setChecked(True)
+
+    def generate_verilog(self, live=False):
         if not self.state_list: return
-        mode = self.encoding_selector.currentText(); num = len(self.state_list)
-        if mode == "Binary":
-            w = max(1, math.ceil(math.log2(num))); ev = [f"{w}'d{i}" for i in range(num)]
-        elif mode == "One-hot":
-            w = num; ev = [f"{w}'b" + ("0"*num)[:num-1-i] + "1" + "0"*i for i in range(num)]
+        model, note = self.current_model(), []
+        try:
+            if self.minimize_check.isChecked():
+                model, groups = minimize_fsm(model)
+                note = [f"// 最小化: {', '.join(g[1:])} 合并入 {g[0]}" for g in groups] + ([""] if groups else [])
+            if model.enc == "ROM": return self.preview_rom(model, note) if live else self.generate_rom(model, note)
+            code = build_module(model) if self.module_check.isChecked() else build_verilog(model)
+        except ValueError as e:
+            if not live: QMessageBox.warning(self, "无法生成", str(e))
+            return
+        self.show_code("\n".join(note + [code]))
+
+    # --- 代码预览：与上次生成的段落比对，只替换变化的段，保留滚动位置；手动改过预览内容则整体重写 ---
+    def show_code(self, text):
+        new, old, doc = code_sections(text), self.preview_sections, self.code_preview.document()
+        if old is None or doc.isModified(): self.code_preview.setPlainText("".join(new))
         else:
-            w = max(1, math.ceil(math.log2(num))); ev = [f"{w}'d{(i >> 1) ^ i}" for i in range(num)]
+            i, n, m = 0, len(old), len(new)
+            while i < min(n, m) and old[i] == new[i]: i += 1
+            j = 0
+            while j < min(n, m) - i and old[n - 1 - j] == new[m - 1 - j]: j += 1
+            starts = [0]
+            for sec in old: starts.append(starts[-1] + sec.count("\n"))
+            ops = SequenceMatcher(None, old[i:n - j], new[i:m - j], autojunk=False).get_opcodes()
+            cur = QTextCursor(doc); cur.beginEditBlock()
+            for tag, a1, a2, b1, b2 in reversed(ops):
+                if tag == "equal": continue
+                cur.setPosition(doc.findBlockByNumber(starts[i + a1]).position())
+                cur.setPosition(doc.findBlockByNumber(starts[i + a2]).position(), QTextCursor.KeepAnchor)
+                cur.insertText("".join(new[i + b1:i + b2]))
+            cur.endEditBlock()
+        doc.setModified(False); self.preview_sections = new
 
-        code = ["/*===================================== FSM ======================================*/\n"]
-        code.append("/*== Encoding ==*/")
-        for i in range(self.param_table.rowCount()):
-            n, v = self.safe_get_text(self.param_table, i, 0), self.safe_get_text(self.param_table, i, 1)
-            if n: code.append(f"parameter   {n.ljust(15)} = {v};")
-        code.append("")
-        for n, v in zip(self.state_list, ev): code.append(f"parameter   {n.upper().ljust(15)} = {v};")
-        code.append(f"reg [{w-1}:0] state;\n")
+    # 实时预览只显示 ROM 封装模块：不弹出对话框，也不写映像文件
+    def preview_rom(self, model, note):
+        try:
+            sim = FSMSimulator(model, TraceLayout.parse(self.trace_layout_edit.text() or ", ".join(f"{n}:1" for n in model.inputs())).fields)
+        except ValueError: return
+        self.show_code("\n".join(note + [build_rom_wrapper(sim, rom_geometry(sim))]))
 
-        rs = self.reset_selector.currentText()
-        code.append("/*== State Transition ==*/\nalways@(posedge sys_clk or negedge sys_rst_n) begin")
-        code.append(f"    if(sys_rst_n == 1'b0)\n        state <= {rs.upper() if rs else 'IDLE'};\n    else case(state)")
-        for st in self.state_list:
-            code.append(f"        {st.upper()}: begin")
-            first = True
-            for i in range(self.table.rowCount()):
-                if self.safe_get_text(self.table, i, 0) == st:
-                    nxt, cond = self.safe_get_text(self.table, i, 1), self.safe_get_text(self.table, i, 2)
-                    p = "if" if first else "else if"; code.append(f"            {p}({cond})\n                state <= {nxt.upper()};")
-                    first = False
-            if not first: code.append(f"            else\n                state <= {st.upper()};")
-            code.append("        end")
-        code.append("        default: state <= IDLE;\n    endcase\nend\n")
-
-        outs = {}
-        for i in range(self.table.rowCount()):
-            a_raw = self.safe_get_text(self.table, i, 3)
-            if '=' not in a_raw: continue
-            for a in a_raw.replace(';',',').split(','):
-                if '=' in a:
-                    k, v = a.split('=')[0].strip(), a.split('=')[1].strip()
-                    outs.setdefault(k, []).append((self.safe_get_text(self.table, i, 0), self.safe_get_text(self.table, i, 2), v))
-        for k, rules in outs.items():
-            code.append(f"// Output: {k}\nalways@(posedge sys_clk or negedge sys_rst_n) begin\n    if(sys_rst_n == 1'b0)\n        {k} <= 'b0;")
-            for s, c, v in rules: code.append(f"    else if((state == {s.upper()}) && ({c}))\n        {k} <= {v};")
-            code.append(f"    else\n        {k} <= {k};\nend\n")
-        self.code_preview.setText("\n".join(code))
+    def generate_rom(self, model, note):
+        layout = self.trace_layout(model)
+        if not layout: return
+        out_dir = QFileDialog.getExistingDirectory(self, "选择 ROM 映像输出目录")
+        if not out_dir: return
+        progress, tick = self.progress_dialog("正在生成 ROM 映像...")
+        try:
+            sim = FSMSimulator(model, layout.fields)
+            g, paths = write_rom(sim, out_dir, progress=tick)
+        except (OSError, ValueError) as e: QMessageBox.warning(self, "生成失败", str(e)); return
+        finally: progress.close()
+        with open(paths[0], 'r', encoding='utf-8') as f_in: self.show_code("\n".join(note + [f_in.read()]))
+        self.sim_log.append(f"[ROM] {1 << g.aw} × {g.dw} bit -> {out_dir}: " + ", ".join(os.path.basename(p) for p in paths))
+
+    def set_optimized_available(self, on):
+        k = self.encoding_selector.findText("Optimized")
+        if on and k < 0: self.encoding_selector.addItem("Optimized")
+        elif not on and k >= 0: self.encoding_selector.removeItem(k)
+
+    def search_encoding(self):
+        model = self.current_model()
+        if len(model.state_list) < 2: return
+        cov = self.current_coverage()
+        weights = [1 + h for h in cov.row_hits] if cov else None
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try: enc_map, cost, edges = optimize_encoding(model, weights, self.enc_budget.value())
+        finally: QApplication.restoreOverrideCursor()
+        base = {mode: encoding_cost(state_encoding(model.state_list, mode)[2], edges) for mode in ("Binary", "Gray", "One-hot")}
+        self.enc_map = enc_map; self.set_optimized_available(True); self.encoding_selector.setCurrentText("Optimized")
+        self.sim_log.append(f"[编码搜索] 代价 {cost:.1f} ({'按仿真覆盖率加权' if cov else '按跳转数加权'}); "
+                            + ", ".join(f"{k} {v:.1f}" for k, v in base.items()))
+
+    def decompose(self):
+        model = self.current_model()
+        if len(model.state_list) < 4: return
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try: t0 = time.perf_counter(); parts, scores = decompose_fsm(model, self.dec_parts.value())
+        except ValueError as e: QMessageBox.warning(self, "无法分解", str(e)); return
+        finally: QApplication.restoreOverrideCursor()
+        self.sim_log.append(f"[分解] 用时 {time.perf_counter() - t0:.2f}s; 各划分 (逻辑级数 / LUT6 / 跨块跳转): "
+                            + ", ".join(f"{k} 块 {d}/{l}/{c}" for k, (d, l, c) in sorted(scores.items())))
+        if len(parts) < 2: self.sim_log.append("  估算逻辑级数未能降低，保持单一状态机"); return
+        self.sim_log.append("\n".join(f"  子状态机 {j}: {len(b)} 个状态" for j, b in enumerate(parts)))
+        self.show_code(build_decomposed_verilog(model, parts))
+
+    def show_minimization(self):
+        t0 = time.perf_counter(); full = self.current_model(); model, groups = minimize_fsm(full)
+        self.sim_log.append(f"[最小化] {len(full.state_list)} -> {len(model.state_list)} 个状态 ({(time.perf_counter() - t0) * 1e3:.1f} ms)")
+        self.sim_log.append("\n".join(f"  可合并: {', '.join(g[1:])} -> {g[0]}" for g in groups) or "  无等价状态")
 
     def save_project(self):
-        f = [[self.safe_get_text(self.table, i, j) for j in range(4)] for i in range(self.table.rowCount())]
-        p = [[self.safe_get_text(self.param_table, i, j) for j in range(3)] for i in range(self.param_table.rowCount())]
+        m = self.current_model()
         path, _ = QFileDialog.getSaveFileName(self, "保存工程", "", "*.json")
         if path:
             with open(path, 'w', encoding='utf-8') as f_out:
-                json.dump({"reset": self.reset_selector.currentText(), "enc": self.encoding_selector.currentText(), "fsm": f, "params": p}, f_out, indent=4)
+                json.dump({"reset": self.reset_selector.currentText(), "enc": m.enc, "fsm": [list(r) for r in m.tree_rows], "params": [list(r) for r in m.params],
+                           "trace_layout": self.trace_layout_edit.text(), "minimize": self.minimize_check.isChecked(), "module": self.module_check.isChecked(),
+                           "enc_map": self.enc_map, "out_style": m.style, "timing": m.timing,
+                           "super": m.entries, "expanded": sorted(self.expanded)}, f_out, indent=4)
 
     def load_project(self):
         path, _ = QFileDialog.getOpenFileName(self, "读取工程", "", "*.json")
         if path:
             with open(path, 'r', encoding='utf-8') as f_in:
-                c = json.load(f_in); self.table.setRowCount(0); self.param_table.setRowCount(0)
-                self.table.blockSignals(True)
-                for r_data in c.get("fsm", []): self.add_row(*r_data)
-                for pr in c.get("params", []): self.add_param_row(*pr)
-                self.table.blockSignals(False); self.encoding_selector.setCurrentText(c.get("enc", "Binary"))
+                c = json.load(f_in)
+                p, f = c.get("params", []), c.get("fsm", [])  # 读取工程记为一条可撤销命令
+                self.fill_table(self.param_table, p); self.fill_table(self.table, f); self.record({"params": p, "fsm": f})
+                self.enc_map = c.get("enc_map", {}); self.set_optimized_available(bool(self.enc_map))
+                self.entries, self.expanded = c.get("super", {}), set(c.get("expanded", []))
+                self.encoding_selector.setCurrentText(c.get("enc", "Binary"))
+                self.trace_layout_edit.setText(c.get("trace_layout", "")); self.minimize_check.setChecked(c.get("minimize", False))
+                self.module_check.setChecked(c.get("module", False))
+                self.style_selector.setCurrentText(c.get("out_style", "Priority"))
+                t = c.get("timing", {}); self.lookahead_check.setChecked(t.get("lookahead", False)); self.fanout_spin.setValue(t.get("max_fanout", 0))
+                self.dup_edit.setText(", ".join(f"{k}:{n}" for k, n in t.get("dup", {}).items()))
                 self.refresh_logic(); self.reset_selector.setCurrentText(c.get("reset", ""))
 
+    def trace_layout(self, model):
+        if not self.trace_layout_edit.text().strip():
+            self.trace_layout_edit.setText(", ".join(f"{n}:1" for n in model.inputs()))
+        try: return TraceLayout.parse(self.trace_layout_edit.text())
+        except ValueError as e: QMessageBox.warning(self, "Trace 布局错误", str(e))
+
+    def progress_dialog(self, text):
+        progress = QProgressDialog(text, "取消", 0, 1000, self)
+        progress.setWindowModality(Qt.WindowModal); progress.setMinimumDuration(300)
+        def tick(done, total):
+            progress.setValue(int(1000 * done / total) if total else 1000); QApplication.processEvents()
+            return progress.wasCanceled()
+        return progress, tick
+
+    def replay_trace_file(self):
+        model = self.current_model(); layout = self.trace_layout(model)
+        if not layout: return
+        path, _ = QFileDialog.getOpenFileName(self, "选择输入 Trace", "", "Trace (*.bin *.trace);;All (*)")
+        if not path: return
+        out, _ = QFileDialog.getSaveFileName(self, "保存状态/输出流", path + ".out", "Trace (*.out *.bin);;All (*)")
+        if not out: return
+        progress, tick = self.progress_dialog("正在回放 Trace...")
+        vcd = os.path.splitext(out)[0] + ".vcd" if self.vcd_check.isChecked() else None
+        t0 = time.perf_counter()
+        try:
+            sim = FSMSimulator(model, layout.fields); cov = CoverageCounter(sim)
+            with open(vcd or os.devnull, 'w') as f_vcd:
+                sinks = [cov] + ([VCDWriter(f_vcd, sim)] if vcd else [])
+                out_layout, rest = replay_trace(sim, path, out, sinks, progress=tick)
+                for sink in sinks: sink.close()
+        except (OSError, ValueError) as e: QMessageBox.warning(self, "回放失败", str(e)); return
+        finally: progress.close()
+        dt = max(time.perf_counter() - t0, 1e-9)
+        self.sim_log.append(f"[回放] {os.path.basename(path)} -> {os.path.basename(out)}: {sim.cycle} 周期, "
+                            f"{dt:.2f}s ({sim.cycle / dt / 1e6:.2f} M周期/s), 输出布局: {out_layout.spec()}")
+        if vcd: self.sim_log.append(f"[波形] 已写出 {vcd}")
+        if rest: self.sim_log.append(f"[警告] Trace 末尾 {rest} 字节不足一条记录，已忽略")
+        self.show_coverage(model, cov)
+
+    def generate_testbench(self):
+        model = self.current_model(); layout = self.trace_layout(model)
+        if not layout: return
+        n = self.tb_vectors.value()
+        if self.tb_source.currentIndex() == 1:
+            path, _ = QFileDialog.getOpenFileName(self, "选择激励 Trace", "", "Trace (*.bin *.trace);;All (*)")
+            if not path: return
+            n = min(n, os.path.getsize(path) // layout.struct.size)
+            chunks = trace_chunks(path, layout, limit=n)
+        else: chunks = random_chunks([w for _, w in layout.fields], n)
+        out_dir = QFileDialog.getExistingDirectory(self, "选择 Testbench 输出目录")
+        if not out_dir: return
+        progress, tick = self.progress_dialog("正在生成 Testbench 向量...")
+        try:
+            sim = FSMSimulator(model, layout.fields)
+            count, paths = write_testbench(sim, out_dir, chunks, progress=lambda done: tick(done, n))
+        except (OSError, ValueError) as e: QMessageBox.warning(self, "生成失败", str(e)); return
+        finally: progress.close()
+        self.sim_log.append(f"[Testbench] {count} 组向量 -> {out_dir}: " + ", ".join(os.path.basename(p) for p in paths))
+
     def resizeEvent(self, event): super().resizeEvent(event); self.draw_fsm()
 
+# --- 3. 逻辑内核：Verilog 表达式翻译 ---
+# 条件/动作中的 Verilog 表达式被翻译成 Python 源码，整表编译为每个状态一个步进函数
+_TOKEN_RE = re.compile(r"\s*(?:(?P<num>\d*\s*'[sS]?[bBoOdDhH]\s*[0-9a-fA-FxXzZ_?]+|\d[\d_]*)|(?P<id>[A-Za-z_][\w$]*)"
+                       r"|(?P<op>===|!==|==|!=|<=|>=|&&|\|\||<<|>>|~&|~\||~\^|\^~|[-+*/%<>!~&|^?:(){}\[\],]))")
+_BINARY_OPS = {'||': 1, '&&': 2, '|': 3, '^': 4, '^~': 4, '~^': 4, '&': 5, '==': 6, '!=': 6, '===': 6, '!==': 6,
+               '<': 7, '<=': 7, '>': 7, '>=': 7, '<<': 8, '>>': 8, '+': 9, '-': 9, '*': 10, '/': 10, '%': 10}
+
+# 条件中的 wait(N)：在当前状态已停留满 N 个周期时为真，由共享的递减计数器实现
+WAIT_KW = "wait"
+_WAIT_RE = re.compile(r"\bwait\s*\(\s*(\d+)\s*\)")
+_WAIT_ANY_RE = re.compile(r"\bwait\s*\(")
+
+def wait_counts(pairs, strict=True):
+    waits = {}
+    for s, c in pairs:
+        found = _WAIT_RE.findall(c)
+        if strict and len(found) != len(_WAIT_ANY_RE.findall(c)): raise ValueError(f"状态 {s} 的条件 '{c}': wait() 的参数必须是十进制整数常量")
+        for n in found: waits[s] = max(waits.get(s, 1), int(n))
+    return waits
+
+def wait_width(waits):
+    return max(1, (max(waits.values()) - 1).bit_length())
+
+@lru_cache(maxsize=65536)
+def tokenize_expr(text):
+    toks, pos, text = [], 0, text.rstrip()
+    while pos < len(text):
+        m = _TOKEN_RE.match(text, pos)
+        if not m: raise ValueError(f"无法识别的符号: {text[pos:].strip()[:12]}")
+        toks.append((m.lastgroup, m.group(m.lastgroup))); pos = m.end()
+    return tuple(toks)
+
+# 单元格标识符索引，按文本缓存：改动一格只重新切分这一格。每项 (名称, 类别, 值)：
+# ('id', None) 出现过；('w', n) 由位选/定宽常量推出的位宽；('min', n) 不定宽常量所需的最少位数；
+# ('ref', 名称) 位宽取自同名参数，或与另一信号比较/直接赋值而位宽相同
+def literal_hint(name, tok):
+    value, size = parse_literal(tok)
+    return (name, 'w', size) if size else (name, 'min', max(value.bit_length(), 1))
+
+@lru_cache(maxsize=65536)
+def cell_width_hints(text, actions=False):
+    hints, acts = [], parse_actions(text) if actions else []
+    for part in ([x for kv in acts for x in kv] if actions else [text]):
+        try: toks = tokenize_expr(part)
+        except ValueError: continue
+        for k, (kind, val) in enumerate(toks):
+            if kind != 'id': continue
+            hints.append((val, 'id', None))
+            nxt = toks[k + 1][1] if k + 1 < len(toks) else None
+            if nxt == '[' and k + 2 < len(toks) and toks[k + 2][0] == 'num':
+                hints.append((val, 'w', parse_literal(toks[k + 2][1])[0] + 1))  # 位选/部分选择的最高位
+            for j, op in ((k - 2, k - 1), (k + 2, k + 1)):  # 与定宽常量或参数比较时取其位宽
+                if 0 <= j < len(toks) and toks[op][1] in _COMPARE_OPS:
+                    kind2, v2 = toks[j]
+                    hints.append(literal_hint(val, v2) if kind2 == 'num' else (val, 'ref', v2))
+    for k, v in acts:  # 赋值为单个常量、参数或信号时，目标位宽随之
+        try: toks = tokenize_expr(v)
+        except ValueError: continue
+        if len(toks) == 1 and toks[0][0] == 'num': hints.append(literal_hint(k, toks[0][1]))
+        elif len(toks) == 1: hints.append((k, 'ref', toks[0][1]))
+    return tuple(hints)
+
+def cell_identifiers(text, actions=False):
+    return tuple(dict.fromkeys(n for n, kind, _ in cell_width_hints(text, actions) if kind == 'id'))
+
+# 文本描述：每行 "SRC -> DST : 条件 / 动作"，条件与动作均可省略；'#' 或 '//' 开头为注释
+_DSL_HEAD_RE = re.compile(r"\s*([A-Za-z_][\w$.]*)\s*->\s*([A-Za-z_][\w$.]*)\s*(.*)$")
+_DSL_TODO_RE = re.compile(r"\s*([A-Za-z_][\w$.]*)?\s*->\s*([A-Za-z_][\w$.]*)?\s*(.*)$")
+_DSL_ACT_RE = re.compile(r"\s*$|\s*[A-Za-z_][\w$]*\s*(\[[^\]]*\])?\s*=(?!=)")
+DSL_TODO = "# 未填完整:"  # 源/目标状态未填的行以注释形式列出，读回时仍保留为表格行
+
+def split_dsl_tail(tail):
+    # 第一个其后整段都像赋值列表的 '/' 才是分隔符：条件里的除号在它之前，动作里的除号在它之后
+    for k, ch in enumerate(tail):
+        if ch == '/' and all(_DSL_ACT_RE.match(p) for p in tail[k + 1:].replace(';', ',').split(',')): return tail[:k], tail[k + 1:]
+    return tail, ""
+
+@lru_cache(maxsize=65536)
+def parse_dsl_line(line):  # -> (行元组 或 None, 错误信息)；按行文本缓存，只有改过的行会重新解析
+    body = line.strip(); todo = body.startswith(DSL_TODO)
+    if todo: body = body[len(DSL_TODO):]
+    elif not body or body.startswith(("#", "//")): return None, ""
+    m = (_DSL_TODO_RE if todo else _DSL_HEAD_RE).match(body)
+    if not m: return None, "应为 '源状态 -> 目标状态 : 条件 / 动作'"
+    src, dst, rest = (x or "" for x in m.groups())
+    if rest and rest[0] not in ":/": return None, f"目标状态后应为 ':' 或 '/'，而不是 '{rest[0]}'"
+    cond, acts = split_dsl_tail(rest[1:] if rest.startswith(":") else rest)
+    cond, acts = cond.strip(), acts.strip()
+    bad = [a.strip() for a in acts.replace(';', ',').split(',') if a.strip() and '=' not in a]
+    if bad: return None, f"动作应为 名称=值: {bad[0]}"
+    any_name = lambda name: ("0", 1)  # 只检查语法，不关心信号是否已定义
+    for what, text in [("条件", cond)] + [(f"动作 {k}", v) for k, v in parse_actions(acts)]:
+        try: translate_expr(text, any_name)
+        except ValueError as e: return None, f"{what}: {e}"
+    return (src, dst, cond, acts), ""
+
+# CSV / TSV：整段文本交给 csv 模块一次解析；首行若是表头则跳过
+TABLE_HEADER = ("当前状态", "下一状态", "跳转条件", "输出动作")
+
+def parse_delimited(text, delimiter):
+    rows = list(csv.reader(io.StringIO(text), delimiter=delimiter))
+    while rows and not any(x.strip() for x in rows[-1]): rows.pop()
+    return rows
+
+def read_table_file(path):
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f_in: text = f_in.read()
+    rows = parse_delimited(text, "\t" if path.lower().endswith((".tsv", ".txt")) else ",")
+    if rows and tuple(x.strip() for x in rows[0][:4]) in (TABLE_HEADER, ("src", "dst", "cond", "action")): rows = rows[1:]
+    return [tuple((r + [""] * 4)[:4]) for r in rows]
+
+def write_table_file(path, rows):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f_out:
+        w = csv.writer(f_out, delimiter="\t" if path.lower().endswith((".tsv", ".txt")) else ",")
+        w.writerow(TABLE_HEADER); w.writerows(rows)
+
+def format_dsl_line(row):
+    s, n, c, a = row
+    line = f"{s} -> {n}" + (f" : {c}" if c else "") + (f" / {a}" if a else "")
+    return line if s and n else f"{DSL_TODO} {line}"
+
+def is_unconditional(cond):
+    return cond.strip() in ("", "1", "1'b1")
+
+def parse_literal(tok):
+    tok = tok.replace('_', '').replace(' ', '')
+    if "'" not in tok: return int(tok), None
+    size, rest = tok.split("'", 1); rest = rest.lstrip('sS')
+    base = {'b': 2, 'o': 8, 'd': 10, 'h': 16}[rest[0].lower()]
+    return int(re.sub('[xXzZ?]', '0', rest[1:]), base), (int(size) if size else None)
+
+def parse_actions(text):
+    acts = []
+    for a in text.replace(';', ',').split(','):
+        if '=' in a:
+            k, v = a.split('=', 1); acts.append((k.strip(), v.strip()))
+    return acts
+
+def _max_w(*ws):
+    ws = [w for w in ws if w]
+    return max(ws) if ws else None
+
+def _const(src):
+    try: return int(eval(compile(src, "<const>", "eval"), {'__builtins__': {}, 'bin': bin}))
+    except NameError: raise ValueError("位选/复制次数必须为常量")
+
+def _binop(op, a, wa, b, wb):
+    if op == '&&': return f"(({a}) != 0 and ({b}) != 0)", 1
+    if op == '||': return f"(({a}) != 0 or ({b}) != 0)", 1
+    if op in ('==', '===', '!=', '!==', '<', '<=', '>', '>='): return f"(({a}) {op[:2]} ({b}))", 1
+    w = _max_w(wa, wb)
+    if op in ('^~', '~^'): return f"(({a}) ^ ({b}) ^ {(1 << (w or 1)) - 1})", w or 1
+    if op == '<<': return (f"((({a}) << ({b})) & {(1 << wa) - 1})" if wa else f"(({a}) << ({b}))"), wa
+    if op == '>>': return f"(({a}) >> ({b}))", wa
+    py = '//' if op == '/' else op
+    if op in ('+', '-', '*') and w: return f"((({a}) {py} ({b})) & {(1 << w) - 1})", w
+    return f"(({a}) {py} ({b}))", w
+
+class _ExprParser:
+    def __init__(self, toks, resolve):
+        self.toks, self.pos, self.resolve = toks, 0, resolve
+
+    def peek(self):
+        return self.toks[self.pos][1] if self.pos < len(self.toks) else None
+
+    def take(self, want=None):
+        if self.pos >= len(self.toks): raise ValueError("表达式不完整")
+        kind, val = self.toks[self.pos]
+        if want and val != want: raise ValueError(f"期望 '{want}'，实际为 '{val}'")
+        self.pos += 1; return kind, val
+
+    def parse(self):
+        res = self.ternary()
+        if self.pos < len(self.toks): raise ValueError(f"多余的符号 '{self.peek()}'")
+        return res
+
+    def ternary(self):
+        c, cw = self.binary(1)
+        if self.peek() != '?': return c, cw
+        self.take('?'); a, wa = self.ternary(); self.take(':'); b, wb = self.ternary()
+        return f"(({a}) if ({c}) else ({b}))", _max_w(wa, wb)
+
+    def binary(self, min_prec):
+        left, lw = self.unary()
+        while True:
+            op = self.peek(); prec = _BINARY_OPS.get(op)
+            if prec is None or prec < min_prec: return left, lw
+            self.take(); right, rw = self.binary(prec + 1)
+            left, lw = _binop(op, left, lw, right, rw)
+
+    def unary(self):
+        op = self.peek()
+        if op not in ('!', '~', '-', '+', '&', '|', '^', '~&', '~|', '~^', '^~'): return self.postfix()
+        self.take(); a, w = self.unary(); mask = (1 << (w or 1)) - 1
+        if op == '!': return f"(({a}) == 0)", 1
+        if op == '~': return f"(({a}) ^ {mask})", w or 1
+        if op == '-': return (f"((-({a})) & {mask})" if w else f"(-({a}))"), w
+        if op == '+': return a, w
+        if op == '&': return f"(({a}) == {mask})", 1
+        if op == '~&': return f"(({a}) != {mask})", 1
+        if op == '|': return f"(({a}) != 0)", 1
+        if op == '~|': return f"(({a}) == 0)", 1
+        if op == '^': return f"(bin({a}).count('1') & 1)", 1
+        return f"(1 ^ (bin({a}).count('1') & 1))", 1
+
+    def postfix(self):
+        kind, val = self.take()
+        if val == '(': src, w = self.ternary(); self.take(')')
+        elif val == '{': src, w = self.concat()
+        elif kind == 'num': v, w = parse_literal(val); src = str(v)
+        elif kind == 'id' and val == WAIT_KW and self.peek() == '(':
+            self.take('('); _, n = self.take(); self.take(')')  # 计数器装载值在生成时确定，只接受十进制整数
+            if not n.isdigit(): raise ValueError(f"wait() 的参数必须是十进制整数常量，实际为 '{n}'")
+            src, w = self.resolve(f"{WAIT_KW}({int(n)})")
+        elif kind == 'id': src, w = self.resolve(val)
+        else: raise ValueError(f"意外的符号 '{val}'")
+        while self.peek() == '[':
+            self.take('['); hi, _ = self.ternary()
+            if self.peek() == ':':
+                self.take(':'); lo, _ = self.ternary(); self.take(']')
+                h, l = _const(hi), _const(lo)
+                src, w = f"((({src}) >> {l}) & {(1 << (h - l + 1)) - 1})", h - l + 1
+            else:
+                self.take(']'); src, w = f"((({src}) >> ({hi})) & 1)", 1
+        return src, w
+
+    def concat(self):
+        first = self.ternary()
+        if self.peek() == '{':
+            n = _const(first[0]); self.take('{'); src, w = self.concat(); self.take('}')
+            if not w: raise ValueError("拼接操作数位宽未知")
+            return "(" + " | ".join(f"(({src}) << {k * w})" for k in range(n)) + ")", n * w
+        parts = [first]
+        while self.peek() == ',': self.take(','); parts.append(self.ternary())
+        self.take('}')
+        if any(w is None for _, w in parts): raise ValueError("拼接操作数位宽未知")
+        srcs, shift = [], 0
+        for p, w in reversed(parts): srcs.append(f"(({p}) << {shift})"); shift += w
+        return "(" + " | ".join(srcs) + ")", shift
+
+def translate_expr(text, resolve):
+    toks = tokenize_expr(text)
+    return _ExprParser(toks, resolve).parse() if toks else ("1", 1)
+
+def evaluate_params(params):
+    vals = {}
+    def resolve(name):
+        if name not in vals: raise ValueError(f"未定义的参数: {name}")
+        return str(vals[name][0]), vals[name][1]
+    for name, val, *_ in params:
+        if not name: continue
+        try: src, w = translate_expr(val, resolve); vals[name] = (_const(src), w)
+        except (ValueError, ArithmeticError, SyntaxError): continue  # 非数值参数不参与仿真
+    return vals
+
+# --- 4. 逻辑内核：模型与周期仿真 ---
+# 层次状态：状态名以 '.' 分隔层级 (如 INIT.WAIT_CLK)，有子状态的前缀即超状态。
+# 导出前展平：叶状态先按自身行、再按由内到外各超状态的行判断；跳入超状态即进入其入口子状态
+HIER_SEP = "."
+
+def hier_parents(name):
+    parts = name.split(HIER_SEP)
+    return [HIER_SEP.join(parts[:k]) for k in range(1, len(parts))]
+
+def hier_tree(names):
+    children = {}
+    for x in names:
+        chain = hier_parents(x) + [x]
+        for p, c in zip(chain, chain[1:]):
+            kids = children.setdefault(p, [])
+            if c not in kids: kids.append(c)
+    return children
+
+def hier_entry(name, children, entries):
+    while name in children:
+        e = entries.get(name, "")
+        name = e if e.startswith(name + HIER_SEP) else children[name][0]
+    return name
+
+def hier_flat(name): return name.replace(HIER_SEP, "_")
+
+def flatten_hierarchy(rows, entries=None, reset=""):
+    names = list(dict.fromkeys(x for r in rows for x in r[:2] if x))
+    if not any(HIER_SEP in x for x in names): return list(rows), list(range(len(rows))), reset
+    children, entries, by_src = hier_tree(names), entries or {}, {}
+    for i, r in enumerate(rows): by_src.setdefault(r[0], []).append(i)
+    dst = lambda n: hier_flat(hier_entry(n, children, entries)) if n else ""
+    out, origin = [], []
+    for x in names + [""]:
+        if x in children or (not x and "" not in by_src): continue
+        for p in ([x] + hier_parents(x)[::-1] if x else [x]):
+            for i in by_src.get(p, ()):
+                _, n, c, a = rows[i]; out.append((hier_flat(x), dst(n), c, a)); origin.append(i)
+    return out, origin, dst(reset)
+
+class FSMModel:
+    def __init__(self, rows, params=(), reset="", enc="Binary", enc_map=None, style="Priority", timing=None, entries=None):
+        self.enc_map, self.style, self.timing = dict(enc_map or {}), style, dict(timing or {})
+        self.tree_rows, self.entries = [tuple((list(r) + [""] * 4)[:4]) for r in rows], dict(entries or {})
+        self.rows, self.origin, reset = flatten_hierarchy(self.tree_rows, self.entries, reset)
+        self.params = [tuple((list(p) + [""] * 3)[:3]) for p in params]
+        self.reset, self.enc, self.meta = reset, enc, {}
+        states = set()
+        for s, n, _, _ in self.rows:
+            if s: states.add(s)
+            if n: states.add(n)
+        self.state_list = sorted(states)
+
+    @classmethod
+    def from_project(cls, path):
+        with open(path, 'r', encoding='utf-8') as f_in: c = json.load(f_in)
+        m = cls(c.get("fsm", []), c.get("params", []), c.get("reset", ""), c.get("enc", "Binary"), c.get("enc_map"), c.get("out_style", "Priority"), c.get("timing"), c.get("super"))
+        m.meta = c; return m
+
+    def encoding(self):
+        return state_encoding(self.state_list, self.enc, self.enc_map)
+
+    def reset_state(self):
+        return self.reset if self.reset in self.state_list else (self.state_list[0] if self.state_list else "")
+
+    def outputs(self):
+        outs = []
+        for _, _, _, a in self.rows:
+            for k, _ in parse_actions(a):
+                if k and k not in outs: outs.append(k)
+        return outs
+
+    def wait_counts(self):
+        return wait_counts((s, c) for s, _, c, _ in self.rows if s)
+
+    def inputs(self):
+        known, ins = set(self.outputs()) | {p[0] for p in self.params} | {WAIT_KW}, []
+        texts = [c for _, _, c, _ in self.rows] + [v for *_, a in self.rows for _, v in parse_actions(a)]
+        for t in texts:
+            for val in cell_identifiers(t):
+                if val not in known and val not in ins: ins.append(val)
+        return ins
+
+def state_encoding(states, mode, enc_map=None):
+    num = len(states)
+    if mode == "Optimized" and enc_map:
+        # 搜索得到的编码；表格改动后新出现的状态依次分配未占用的码字
+        used = {enc_map[st] for st in states if st in enc_map}; free = (v for v in range(1 << 30) if v not in used)
+        vals = [enc_map[st] if st in enc_map else next(free) for st in states]
+        w = max(1, math.ceil(math.log2(num)), max(vals).bit_length())
+        return w, [f"{w}'d{v}" for v in vals], vals
+    if mode == "One-hot":
+        vals = [1 << i for i in range(num)]; w = num
+        return w, [f"{w}'b" + ("0"*num)[:num-1-i] + "1" + "0"*i for i in range(num)], vals
+    w = max(1, math.ceil(math.log2(num)))
+    vals = [(i >> 1) ^ i for i in range(num)] if mode == "Gray" else list(range(num))
+    return w, [f"{w}'d{v}" for v in vals], vals
+
+# 每个仿真块：起始周期、输入记录、时钟沿后的状态序号、命中行号(-1 为保持)、输出寄存器值
+SimChunk = namedtuple("SimChunk", "start inputs states rows outputs")
+
+class FSMSimulator:
+    def __init__(self, model, inputs):
+        if not model.state_list: raise ValueError("状态转移表为空，无法仿真")
+        self.model, self.inputs = model, [(n, int(w)) for n, w in inputs]
+        self.states, self.outputs = model.state_list, model.outputs()
+        params = evaluate_params(model.params)
+        in_idx = {n: k for k, (n, _) in enumerate(self.inputs)}
+        out_idx = {n: j for j, n in enumerate(self.outputs)}
+        st_idx = {s: k for k, s in enumerate(self.states)}
+        self.out_widths = [None] * len(self.outputs)
+        # 等待计数器：进入 wait 状态时装入 N-1，停留期间递减到 0；wait(n) 即计数值 <= N-n
+        waits = model.wait_counts(); cur = [None]
+        self.wait, self.wait_load = [0], [max(waits.get(s, 1) - 1, 0) for s in self.states]
+
+        def resolve(name):
+            if name.startswith(WAIT_KW + "("): return f"(W[0] <= {waits[cur[0]] - int(name[len(WAIT_KW) + 1:-1])})", 1
+            if name in params: return str(params[name][0]), params[name][1]
+            if name in out_idx: return f"o[{out_idx[name]}]", self.out_widths[out_idx[name]]
+            if name in in_idx: return f"i[{in_idx[name]}]", self.inputs[in_idx[name]][1]
+            raise ValueError(f"输入信号 {name} 未在 Trace 布局中声明")
+
+        def compile_expr(r, text, what):
+            cur[0] = model.rows[r][0]
+            try: return translate_expr(text, resolve)
+            except ValueError as e: raise ValueError(f"第 {r + 1} 行{what} '{text}': {e}")
+
+        by_state, acts = {}, {}
+        for r, (s, n, c, a) in enumerate(model.rows):
+            if not (s and n): continue
+            by_state.setdefault(s, []).append(r)
+            for k, v in parse_actions(a):
+                j = out_idx[k]
+                if (r, j) in acts: continue  # 同一行重复赋值时仅首个生效
+                acts[(r, j)] = compile_expr(r, v, "动作")
+                src, w = acts[(r, j)]
+                if w is None and re.fullmatch(r"\d+", src): w = max(1, int(src).bit_length())
+                self.out_widths[j] = _max_w(self.out_widths[j], w)
+        self.out_widths = [w or 32 for w in self.out_widths]
+
+        lines = []
+        for k, s in enumerate(self.states):
+            rows = by_state.get(s, [])
+            conds = {r: compile_expr(r, model.rows[r][2], "条件")[0] for r in rows}
+            lines.append(f"def _s{k}(i, o):")
+            for m, r in enumerate(rows):
+                lines.append(f"    {'if' if m == 0 else 'elif'} {conds[r]}: n, r = {st_idx[model.rows[r][1]]}, {r}")
+            lines.append(f"    {'else: ' if rows else ''}n, r = {k}, -1")
+            touched = []
+            for j in range(len(self.outputs)):
+                rules = [(r, acts[(r, j)][0]) for r in rows if (r, j) in acts]
+                if not rules: continue
+                mask = (1 << self.out_widths[j]) - 1
+                # 本状态每一行都给该输出赋值时，输出值直接由命中行决定，无需重复求值条件
+                guard = (lambda r: f"r == {r}") if len(rules) == len(rows) else (lambda r: conds[r])
+                for m, (r, v) in enumerate(rules):
+                    lines.append(f"    {'if' if m == 0 else 'elif'} {guard(r)}: v{j} = ({v}) & {mask}")
+                lines.append(f"    else: v{j} = o[{j}]")
+                touched.append(j)
+            lines += [f"    o[{j}] = v{j}" for j in touched]
+            if waits:
+                lines.append(f"    if n != {k}: W[0] = L[n]")
+                if s in waits: lines.append("    elif W[0]: W[0] -= 1")
+            lines += ["    return n, r", ""]
+        ns = {"W": self.wait, "L": self.wait_load}
+        exec(compile("\n".join(lines), "<fsm>", "exec"), ns)
+        self._steps = [ns[f"_s{k}"] for k in range(len(self.states))]
+        self.reset()
+
+    def reset(self):
+        self.state, self.cycle = self.states.index(self.model.reset_state()), 0
+        self.wait[0] = self.wait_load[self.state]
+        self.regs = [0] * len(self.outputs)
+
+    def run_chunk(self, records):
+        steps, o, s = self._steps, self.regs, self.state
+        ins, states, rows, outs = [], array('I'), array('i'), []
+        in_app, st_app, rw_app, out_app = ins.append, states.append, rows.append, outs.append
+        for rec in records:
+            s, r = steps[s](rec, o)
+            in_app(rec); st_app(s); rw_app(r); out_app(tuple(o))
+        chunk = SimChunk(self.cycle, ins, states, rows, outs)
+        self.state = s; self.cycle += len(states)
+        return chunk
+
+    def run(self, chunks, sinks=(), progress=None):
+        for records in chunks:
+            chunk = self.run_chunk(records)
+            for sink in sinks: sink.consume(chunk)
+            if progress and progress(self.cycle): break
+        return self
+
+# --- 5. Trace 回放：内存映射输入，分块流式输出 ---
+class TraceLayout:
+    _CODES = ((8, 'B'), (16, 'H'), (32, 'I'), (64, 'Q'))
+
+    def __init__(self, fields):
+        self.fields, codes = [(n, int(w)) for n, w in fields], []
+        for n, w in self.fields:
+            code = next((c for bits, c in self._CODES if w <= bits), None)
+            if code is None or w < 1: raise ValueError(f"信号 {n} 位宽 {w} 超出支持范围 (1~64)")
+            codes.append(code)
+        self.struct = struct.Struct('<' + ''.join(codes))
+
+    @classmethod
+    def parse(cls, spec):
+        fields = []
+        for part in spec.replace(';', ',').split(','):
+            if not part.strip(): continue
+            name, _, w = part.partition(':')
+            try: fields.append((name.strip(), int(w or 1)))
+            except ValueError: raise ValueError(f"布局格式错误: {part.strip()} (应为 名称:位宽)")
+        if not fields: raise ValueError("Trace 布局为空")
+        return cls(fields)
+
+    def spec(self):
+        return ", ".join(f"{n}:{w}" for n, w in self.fields)
+
+class TraceWriter:
+    def __init__(self, f_out, layout):
+        self.f, self.pack = f_out, layout.struct.pack
+
+    def consume(self, chunk):
+        pack = self.pack
+        self.f.write(b"".join([pack(s, *o) for s, o in zip(chunk.states, chunk.outputs)]))
+
+def trace_chunks(trace_path, layout, chunk=65536, limit=None):
+    rec = layout.struct.size
+    with open(trace_path, 'rb') as f_in:
+        end = os.fstat(f_in.fileno()).st_size // rec * rec
+        if limit is not None: end = min(end, limit * rec)
+        if not end: return
+        # iter_unpack 直接解析 mmap 的切片视图，整个 Trace 不会被读入内存
+        with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as mv:
+            for off in range(0, end, chunk * rec):
+                yield layout.struct.iter_unpack(mv[off:min(off + chunk * rec, end)])
+
+def replay_trace(sim, trace_path, out_path, sinks=(), chunk=65536, progress=None):
+    layout = TraceLayout(sim.inputs)
+    out_layout = TraceLayout([("state", max(1, (len(sim.states) - 1).bit_length()))] + list(zip(sim.outputs, sim.out_widths)))
+    size = os.path.getsize(trace_path); total = size // layout.struct.size
+    with open(out_path, 'wb') as f_out:
+        sim.run(trace_chunks(trace_path, layout, chunk), [TraceWriter(f_out, out_layout), *sinks],
+                progress=(lambda done: progress(done, total)) if progress else None)
+    with open(out_path + ".json", 'w', encoding='utf-8') as f_meta:
+        json.dump({"layout": out_layout.spec(), "states": sim.states, "input": os.path.basename(trace_path)}, f_meta, indent=4)
+    return out_layout, size - total * layout.struct.size
+
+# --- 6. VCD 波形导出：只记录变化值，按块缓冲写盘 ---
+class VCDWriter:
+    def __init__(self, f_out, sim, timescale="1ns", period=10, buf_size=1 << 20):
+        self.f, self.period, self.buf_size = f_out, period, buf_size
+        self.names = sim.states
+        self.sw, _, self.codes = sim.model.encoding()
+        self.widths = list(sim.out_widths)
+        ids = [self._ident(k) for k in range(len(self.widths) + 2)]
+        self.sid, self.nid, self.oids = ids[0], ids[1], ids[2:]
+        hdr = [f"$date {time.strftime('%Y-%m-%d %H:%M:%S')} $end", "$version FPGA FSM Designer $end",
+               f"$timescale {timescale} $end", "$scope module fsm $end",
+               f"$var reg {self.sw} {self.sid} state $end", f"$var string 1 {self.nid} state_name $end"]
+        hdr += [f"$var reg {w} {i} {n} $end" for n, w, i in zip(sim.outputs, self.widths, self.oids)]
+        hdr += ["$upscope $end", "$enddefinitions $end", "#0", "$dumpvars"]
+        self.last_s, self.last_o = sim.state, tuple(sim.regs)
+        hdr += [self._state(sim.state)] + [self._val(v, j) for j, v in enumerate(self.last_o)] + ["$end", ""]
+        self.buf, self.size, self.end = ["\n".join(hdr)], 0, 0
+
+    @staticmethod
+    def _ident(k):
+        s = ""
+        while True:
+            s += chr(33 + k % 94); k //= 94
+            if not k: return s
+
+    def _val(self, v, j):
+        w = self.widths[j]
+        return f"{v & 1}{self.oids[j]}" if w == 1 else f"b{v:b} {self.oids[j]}"
+
+    def _state(self, s):
+        code = self.codes[s]
+        v = f"{code & 1}{self.sid}" if self.sw == 1 else f"b{code:b} {self.sid}"
+        return f"{v}\ns{self.names[s]} {self.nid}"
+
+    def consume(self, chunk):
+        buf, period, last_s, last_o = self.buf, self.period, self.last_s, self.last_o
+        t = (chunk.start + 1) * period; size = 0
+        for s, o in zip(chunk.states, chunk.outputs):
+            if s != last_s or o != last_o:
+                lines = [f"#{t}"]
+                if s != last_s: lines.append(self._state(s)); last_s = s
+                if o != last_o:
+                    lines += [self._val(v, j) for j, (v, p) in enumerate(zip(o, last_o)) if v != p]; last_o = o
+                line = "\n".join(lines) + "\n"; buf.append(line); size += len(line)
+            t += period
+        self.last_s, self.last_o, self.end = last_s, last_o, t - period
+        self.size += size
+        if self.size >= self.buf_size: self.flush()
+
+    def flush(self):
+        self.f.write("".join(self.buf)); self.buf.clear(); self.size = 0
+
+    def close(self):
+        if self.end: self.buf.append(f"#{self.end}\n")
+        self.flush()
+
+# --- 7. 覆盖率统计：按块计数，不进入逐周期热循环 ---
+class CoverageCounter:
+    def __init__(self, sim):
+        self.states = sim.states
+        self.row_hits, self.state_hits = [0] * len(sim.model.rows), [0] * len(sim.states)
+        self.hold, self.cycles = 0, 0
+
+    def consume(self, chunk):
+        # Counter 对 array 的计数在 C 层完成，相当于 bincount
+        for r, c in Counter(chunk.rows).items():
+            if r < 0: self.hold += c
+            else: self.row_hits[r] += c
+        for st, c in Counter(chunk.states).items(): self.state_hits[st] += c
+        self.cycles += len(chunk.states)
+
+def heat_level(hits, peak):
+    return math.log1p(hits) / math.log1p(peak) if hits and peak else 0.0
+
+def heat_color(hits, peak):
+    if not hits: return "lightgray"
+    return f"{0.16 * (1 - heat_level(hits, peak)):.3f} 0.85 1.000"  # 黄 -> 红
+
+def coverage_report(model, cov):
+    live = [r for r, (s, n, _, _) in enumerate(model.rows) if s and n]
+    hit = sum(1 for r in live if cov.row_hits[r])
+    lines = [f"[覆盖率] {cov.cycles} 周期, 跳转行 {hit}/{len(live)} ({100.0 * hit / max(len(live), 1):.1f}%), "
+             f"状态 {sum(1 for h in cov.state_hits if h)}/{len(cov.states)}, 保持周期 {cov.hold}"]
+    for r in live:
+        s, n, c, _ = model.rows[r]; h = cov.row_hits[r]
+        lines.append(f"  #{model.origin[r] + 1:<4} {s} -> {n} [{c}]: {h}{'' if h else '  <未覆盖>'}")
+    lines += [f"  状态 {st}: {h} 周期{'' if h else '  <未到达>'}" for st, h in zip(cov.states, cov.state_hits)]
+    return lines
+
+# --- 8. Verilog 代码生成 ---
+# 输出规则化简：每个输出 -> (默认值, [(状态, [(条件, 值)])])，默认值为 None 时未命中保持原值
+FOLD_MAX_BITS = 12
+
+def fold_output_rules(model, widths=None):
+    widths = widths if widths is not None else infer_signal_widths(model)
+    params = evaluate_params(model.params); outs = model.outputs(); sure = sized_signals(model)
+    def pres(name):
+        if name in params: return str(params[name][0]), params[name][1]
+        raise ValueError(name)
+    @lru_cache(maxsize=None)
+    def norm(v):  # 常量取值按数值比较，1'b0 与 0 视为相同
+        try: return _const(translate_expr(v, pres)[0])
+        except (ValueError, ArithmeticError, SyntaxError, TypeError): return v.strip()
+    @lru_cache(maxsize=None)
+    def cover(conds):
+        # 条件只涉及少量输入位时穷举：返回覆盖全部输入组合所需的最短前缀长度，否则 None
+        names = sorted({v for c in conds for kind, v in tokenize_expr(c) if kind == 'id' and v not in params})
+        # 只对位宽确定的输入穷举，否则按推断位宽枚举会漏掉取值而改变行为
+        if any(x in outs or x not in widths or x not in sure for x in names) or sum(widths[x] for x in names) > FOLD_MAX_BITS: return None
+        pos = {x: k for k, x in enumerate(names)}
+        def res(name):
+            if name in pos: return f"i[{pos[name]}]", widths[name]
+            return pres(name)
+        fs = [eval(compile(f"lambda i: {translate_expr(c, res)[0]}", "<cond>", "eval")) for c in conds]
+        vecs = [[]]
+        for x in names: vecs = [vec + [v] for vec in vecs for v in range(1 << widths[x])]
+        for m, f in enumerate(fs):
+            vecs = [i for i in vecs if not f(i)]
+            if not vecs: return m + 1
+        return None
+    res_map = {}
+    for k in outs:
+        chains = {}
+        for s, _, c, a in model.rows:
+            if not s: continue
+            v = next((v for n, v in parse_actions(a) if n == k), None)  # 同一行重复赋值时仅首个生效
+            if v is None: continue
+            chain = chains.setdefault(s, [])
+            if not (chain and is_unconditional(chain[-1][0])): chain.append([c, v])
+        full = {}
+        for s, chain in chains.items():
+            if not is_unconditional(chain[-1][0]):
+                try: m = cover(tuple(c for c, _ in chain))
+                except (ValueError, ArithmeticError, SyntaxError, TypeError): m = None
+                if m: del chain[m:]; chain[-1][0] = ""
+            # 合并相邻的同值规则，去掉末尾显式保持原值的规则
+            merged = []
+            for c, v in chain:
+                if merged and norm(merged[-1][1]) == norm(v):
+                    merged[-1][0] = "" if is_unconditional(c) or is_unconditional(merged[-1][0]) else f"({merged[-1][0]}) || ({c})"
+                else: merged.append([c, v])
+            while merged and merged[-1][1].strip() == k: merged.pop()
+            chains[s] = merged; full[s] = bool(merged) and is_unconditional(merged[-1][0])
+        # 所有状态都完整赋值时，保持分支永不生效：取最常见的末尾值作默认值并删去以它结尾的规则
+        dflt = None
+        if model.state_list and all(full.get(st) for st in model.state_list):
+            dflt = Counter(norm(chain[-1][1]) for chain in chains.values()).most_common(1)[0][0]
+            dflt_text = next(chain[-1][1] for chain in chains.values() if norm(chain[-1][1]) == dflt)
+            for chain in chains.values():
+                if norm(chain[-1][1]) == dflt: chain.pop()
+            dflt = dflt_text
+        res_map[k] = (dflt, [(s, [tuple(r) for r in chain]) for s, chain in chains.items() if chain])
+    return res_map
+
+def build_verilog(model):
+    w, ev, _ = model.encoding()
+    look, fanout = model.timing.get("lookahead", False), model.timing.get("max_fanout", 0)
+    waits = model.wait_counts()
+    if waits:
+        # wait(n) 换成与共享计数器的比较；计数器在进入状态时装入，需要组合逻辑的 next_state
+        cw = wait_width(waits)
+        sub = lambda s, c: _WAIT_RE.sub(lambda m: f"(wait_cnt <= {cw}'d{waits[s] - int(m.group(1))})", c)
+        model = FSMModel([(s, d, sub(s, c) if s in waits else c, a) for s, d, c, a in model.rows], model.params,
+                         model.reset, model.enc, model.enc_map, model.style, model.timing)
+    comb = look or bool(waits)
+    code = ["/*===================================== FSM ======================================*/\n"]
+    code.append("/*== Encoding ==*/")
+    for n, v, _ in model.params:
+        if n: code.append(f"parameter   {n.ljust(15)} = {v};")
+    code.append("")
+    for n, v in zip(model.state_list, ev): code.append(f"parameter   {n.upper().ljust(15)} = {v};")
+    attr = f"(* max_fanout = {fanout} *) " if fanout else ""
+    code.append(f"{attr}reg [{w-1}:0] state;" + (f"\nreg [{w-1}:0] next_state;" if comb else "") + (f"\nreg [{cw-1}:0] wait_cnt;" if waits else "") + "\n")
+
+    rs = model.reset_state().upper() or 'IDLE'
+    # 前瞻模式下次态为组合逻辑，state 与由 next_state 译码的输出寄存器在同一时钟沿更新
+    tgt, op = ("next_state", "=") if comb else ("state", "<=")
+    if comb: code.append("/*== Next State ==*/\nalways@(*) begin\n    case(state)")
+    else:
+        code.append("/*== State Transition ==*/\nalways@(posedge sys_clk or negedge sys_rst_n) begin")
+        code.append(f"    if(sys_rst_n == 1'b0)\n        state <= {rs};\n    else case(state)")
+    by_state = {}
+    for r in model.rows: by_state.setdefault(r[0], []).append(r)
+    for st in model.state_list:
+        code.append(f"        {st.upper()}: begin")
+        first = True
+        for _, nxt, cond, _ in by_state.get(st, []):
+            p = "if" if first else "else if"; code.append(f"            {p}({cond})\n                {tgt} {op} {nxt.upper()};")
+            first = False
+        if not first: code.append(f"            else\n                {tgt} {op} {st.upper()};")
+        elif comb: code.append(f"            {tgt} {op} {st.upper()};")  # 组合逻辑每个分支都要赋值，避免锁存器
+        code.append("        end")
+    code.append(f"        default: {tgt} {op} {rs};\n    endcase\nend\n")
+    if comb:
+        code.append("/*== State Register ==*/\nalways@(posedge sys_clk or negedge sys_rst_n) begin")
+        code.append(f"    if(sys_rst_n == 1'b0)\n        state <= {rs};\n    else\n        state <= next_state;\nend\n")
+
+    if waits:
+        load = lambda st: f"{cw}'d{waits.get(st, 1) - 1}"
+        code.append("/*== Wait Counter ==*/\nalways@(posedge sys_clk or negedge sys_rst_n) begin")
+        code.append(f"    if(sys_rst_n == 1'b0)\n        wait_cnt <= {load(model.reset_state())};")
+        code.append("    else if(next_state != state) begin\n        case(next_state)")
+        code += [f"            {st.upper()}: wait_cnt <= {load(st)};" for st in model.state_list if st in waits]
+        code.append(f"            default: wait_cnt <= {cw}'d0;\n        endcase\n    end")
+        code.append(f"    else if(wait_cnt != {cw}'d0)\n        wait_cnt <= wait_cnt - 1'b1;\nend\n")
+
+    # 寄存器复制：每份副本使用相同的逻辑，并禁止综合工具把它们合并回去
+    dup, widths = model.timing.get("dup", {}), infer_signal_widths(model)
+    copies = {k: [k] + [f"{k}_dup{i}" for i in range(1, n)] for k, n in dup.items() if n > 1 and k in model.outputs()}
+    if copies:
+        code.append("/*== Duplicated Output Registers ==*/")
+        attr = f"(* max_fanout = {fanout}, equivalent_register_removal = \"no\", keep = \"true\" *)" if fanout else \
+               "(* equivalent_register_removal = \"no\", keep = \"true\" *)"
+        for k, names in copies.items():
+            for n in names[1:]: code.append(f"{attr} reg {_vec(widths.get(k, 1))}{n};")
+        code.append("")
+    ahead = lookahead_values(model) if look else {}
+    for k, (dflt, chains) in fold_output_rules(model, widths).items():
+        for t in copies.get(k, [k]):
+            if k in ahead:
+                code.append(f"// Output: {t} (前瞻: 由 next_state 译码)\nalways@(posedge sys_clk or negedge sys_rst_n) begin\n    if(sys_rst_n == 1'b0)\n        {t} <= 'b0;")
+                code += lookahead_output(t, ahead[k]); continue
+            note = " (依赖输入，保持当前状态译码)" if look else ""
+            code.append(f"// Output: {t}{note}\nalways@(posedge sys_clk or negedge sys_rst_n) begin\n    if(sys_rst_n == 1'b0)\n        {t} <= 'b0;")
+            if model.style == "Case" and chains: code += case_output(t, dflt or t, chains); continue
+            for s, chain in chains:
+                for c, v in chain:
+                    guard = f"state == {s.upper()}" if is_unconditional(c) else f"(state == {s.upper()}) && ({c})"
+                    code.append(f"    else if({guard})\n        {t} <= {v};")
+            code.append(f"    else\n        {t} <= {dflt or t};\nend\n")
+    return "\n".join(code)
+
+# 完整模块：输入端口为条件/动作中引用、且不是参数/输出/状态名的信号，输出端口取动作目标的信号名，位宽均来自推断结果
+MODULE_INTERNAL = ("sys_clk", "sys_rst_n", "state", "next_state", "wait_cnt")
+
+def build_module(model, name="fsm_ctrl"):
+    widths, states = infer_signal_widths(model), set(model.state_list) | {s.upper() for s in model.state_list}
+    ins = [n for n in model.inputs() if n not in MODULE_INTERNAL and n not in states]
+    outs = list(dict.fromkeys(m.group() for m in (re.match(r"[A-Za-z_][\w$]*", k) for k in model.outputs()) if m))
+    ports = [f"{d} {_vec(widths.get(n, 1)).ljust(8)}{n}" for d, names in (("input  wire", ["sys_clk", "sys_rst_n"] + ins), ("output reg ", outs)) for n in names]
+    body = "\n".join(("    " + line) if line else line for line in build_verilog(model).split("\n"))
+    return f"module {name} (\n" + ",\n".join("    " + p for p in ports) + "\n);\n\n" + body + "\nendmodule\n"
+
+def lookahead_values(model):
+    # 找出取值只由所进入状态决定的输出 (前瞻 Moore 型)：{输出: {状态: 常量文本}}
+    params = evaluate_params(model.params); rs = model.reset_state()
+    def pres(name):
+        if name in params: return str(params[name][0]), params[name][1]
+        raise ValueError(name)
+    def const(v):
+        try: return _const(translate_expr(v, pres)[0])
+        except (ValueError, ArithmeticError, SyntaxError, TypeError): return None
+    chains = {}
+    for s, n, c, a in model.rows:
+        if s and n: chains.setdefault(s, []).append((c, n, a))
+    res = {}
+    for k in model.outputs():
+        val, text, holds, ok = {rs: 0}, {0: "'b0"}, [], True
+        for s, chain in chains.items():
+            seen_hold = total = False
+            for c, n, a in chain:
+                v = next((v for n2, v in parse_actions(a) if n2 == k), None)
+                # 不赋值的行排在赋值行之前时，输出可能由跳转之外的另一行决定 (即使该行已被无条件行屏蔽)
+                if v is not None and seen_hold: ok = False; break
+                if total: continue
+                if v is None: seen_hold = True; holds.append((s, n))
+                else:
+                    x = const(v)
+                    if x is None or val.setdefault(n, x) != x: ok = False; break
+                    text.setdefault(x, v.strip())
+                total = is_unconditional(c)
+            if not ok: break
+            if not total: holds.append((s, s))
+        # 保持原值的跳转要求源、目标状态取值一致；沿这些跳转传播直到不动点
+        changed = ok
+        while ok and changed:
+            changed = False
+            for s, d in holds:
+                if s not in val: continue
+                if d not in val: val[d] = val[s]; changed = True
+                elif val[d] != val[s]: ok = False; break
+        if ok: res[k] = {s: text[x] for s, x in val.items()}
+    return res
+
+def lookahead_output(k, vals):
+    groups = {}
+    for s, v in vals.items(): groups.setdefault(v, []).append(s.upper())
+    dflt = max(groups, key=lambda v: len(groups[v]))  # 最常见的取值并入 default，其余状态并行译码
+    code = ["    else case(next_state)"]
+    code += [f"        {', '.join(sts)}: {k} <= {v};" for v, sts in groups.items() if v != dflt]
+    code.append(f"        default: {k} <= {dflt};\n    endcase\nend\n")
+    return code
+
+def case_output(k, hold, chains):
+    # 先按 state 译码，再在状态内按行序判断条件：逻辑级数只取决于单个状态的规则数
+    moore, code = {}, ["    else case(state)"]
+    for s, chain in chains:  # 状态内只剩一条无条件赋值 (Moore 型) 的状态按取值合并为并行译码项
+        if len(chain) == 1 and is_unconditional(chain[0][0]): moore.setdefault(chain[0][1], []).append(s.upper())
+    for v, sts in moore.items(): code.append(f"        {', '.join(sts)}: {k} <= {v};")
+    for s, chain in chains:
+        if len(chain) == 1 and is_unconditional(chain[0][0]): continue
+        code.append(f"        {s.upper()}: begin")
+        for m, (c, v) in enumerate(chain):
+            p = "else" if m and is_unconditional(c) else ("if" if m == 0 else "else if") + f"({c})"
+            code.append(f"            {p}\n                {k} <= {v};")
+        if not is_unconditional(chain[-1][0]): code.append(f"            else\n                {k} <= {hold};")
+        code.append("        end")
+    code.append(f"        default: {k} <= {hold};\n    endcase\nend\n")
+    return code
+
+# --- 9. 自检 Testbench 生成：仿真结果流式写出为 $readmemh 向量 ---
+def random_chunks(widths, count, chunk=65536, seed=None):
+    bits = random.Random(seed).getrandbits
+    for off in range(0, count, chunk):
+        yield [tuple(bits(w) for w in widths) for _ in range(min(chunk, count - off))]
+
+def _pack_bits(values, widths, v=0):
+    for x, w in zip(values, widths): v = (v << w) | (x & ((1 << w) - 1))
+    return v
+
+def _vec(w):
+    return f"[{w - 1}:0] " if w > 1 else ""
+
+class TestbenchWriter:
+    def __init__(self, f_stim, f_exp, sim):
+        self.f_stim, self.f_exp, self.count = f_stim, f_exp, 0
+        self.in_w, self.out_w = [w for _, w in sim.inputs], list(sim.out_widths)
+        self.sw, _, self.codes = sim.model.encoding()
+        self.iw, self.ew = max(1, sum(self.in_w)), self.sw + sum(self.out_w)
+
+    def consume(self, chunk):
+        in_w, out_w, codes = self.in_w, self.out_w, self.codes
+        ni, ne = -(-self.iw // 4), -(-self.ew // 4)
+        self.f_stim.write("".join([f"{_pack_bits(rec, in_w):0{ni}x}\n" for rec in chunk.inputs]))
+        self.f_exp.write("".join([f"{_pack_bits(o, out_w, codes[s]):0{ne}x}\n" for s, o in zip(chunk.states, chunk.outputs)]))
+        self.count += len(chunk.states)
+
+FSM_CHECKER = """module fsm_checker #(parameter W = 8, parameter MAX_ERR = 10) (
+    input  wire         clk,
+    input  wire         en,
+    input  wire [31:0]  idx,
+    input  wire [W-1:0] actual,
+    input  wire [W-1:0] expected
+);
+    integer errors = 0;
+    always @(negedge clk) if (en && actual !== expected) begin
+        errors = errors + 1;
+        if (errors <= MAX_ERR) $display("MISMATCH @ vector %0d: got %h, expected %h", idx, actual, expected);
+    end
+endmodule"""
+
+def build_testbench(sim, tbw, core="fsm_core.v", stim="fsm_stim.mem", expect="fsm_expect.mem", period=10):
+    ins = "{" + ", ".join(n for n, _ in sim.inputs) + "}"
+    actual = "{" + ", ".join(["state"] + sim.outputs) + "}"
+    tb = ["`timescale 1ns/1ps", "// 自检 Testbench：激励与期望值由内置模型仿真生成", "module tb_fsm;",
+          f"    localparam TB_N  = {max(tbw.count, 1)};", f"    localparam TB_IW = {tbw.iw};", f"    localparam TB_EW = {tbw.ew};", "",
+          "    reg  sys_clk = 1'b0;", "    reg  sys_rst_n = 1'b0;"]
+    tb += [f"    reg  {_vec(w)}{n} = 0;" for n, w in sim.inputs]
+    tb += [f"    reg  {_vec(w)}{n};" for n, w in zip(sim.outputs, sim.out_widths)]
+    tb += ["", f"    `include \"{core}\"", "",
+           "    reg  [TB_IW-1:0] tb_stim   [0:TB_N-1];", "    reg  [TB_EW-1:0] tb_expect [0:TB_N-1];",
+           "    reg  tb_chk_en = 1'b0;", "    integer tb_idx = 0;", "",
+           f"    always #{period / 2:g} sys_clk = ~sys_clk;", "",
+           "    fsm_checker #(.W(TB_EW)) u_chk (.clk(sys_clk), .en(tb_chk_en), .idx(tb_idx),",
+           f"        .actual({actual}), .expected(tb_expect[tb_idx]));", "",
+           "    initial begin", f"        $readmemh(\"{stim}\", tb_stim);", f"        $readmemh(\"{expect}\", tb_expect);",
+           "        repeat (2) @(negedge sys_clk);", "        sys_rst_n = 1'b1;",
+           "        for (tb_idx = 0; tb_idx < TB_N; tb_idx = tb_idx + 1) begin"]
+    if sim.inputs: tb.append(f"            {ins} = tb_stim[tb_idx];")
+    # 比较在下降沿进行：使能在上升沿之后才打开，保证第 0 个向量也是在时钟沿生效之后才比较
+    tb += ["            @(posedge sys_clk); tb_chk_en = 1'b1;", "            @(negedge sys_clk); #1;", "        end", "        tb_chk_en = 1'b0;",
+           "        if (u_chk.errors == 0) $display(\"PASS: %0d vectors\", TB_N);",
+           "        else $display(\"FAIL: %0d mismatches in %0d vectors\", u_chk.errors, TB_N);",
+           "        $finish;", "    end", "endmodule", "", FSM_CHECKER, ""]
+    return "\n".join(tb)
+
+def write_testbench(sim, out_dir, chunks, progress=None):
+    os.makedirs(out_dir, exist_ok=True); paths = [os.path.join(out_dir, f) for f in ("tb_fsm.v", "fsm_core.v", "fsm_stim.mem", "fsm_expect.mem")]
+    with open(paths[2], 'w') as f_stim, open(paths[3], 'w') as f_exp:
+        tbw = TestbenchWriter(f_stim, f_exp, sim)
+        sim.run(chunks, [tbw], progress)
+    with open(paths[1], 'w', encoding='utf-8') as f_out: f_out.write(build_verilog(sim.model))
+    with open(paths[0], 'w', encoding='utf-8') as f_out: f_out.write(build_testbench(sim, tbw))
+    return tbw.count, paths
+
+# --- 10. 图分析：整数邻接索引上的可达性 / 强连通分量 / 陷阱检测 ---
+class GraphReport:
+    def __init__(self, names, live, reset, dist, parent, sccs, sinks, traps):
+        self.names, self.reset, self.dist, self.parent, self.sccs = names, reset, dist, parent, sccs
+        self.unreachable = {names[v] for v in live if dist[v] < 0} if reset is not None else set()
+        self.sinks = {names[v] for v in sinks}
+        self.traps = [{names[v] for v in c} for c in traps]
+
+    def path(self, state_id):
+        if self.dist[state_id] < 0: return []
+        path = [state_id]
+        while self.parent[path[-1]] >= 0: path.append(self.parent[path[-1]])
+        return [self.names[v] for v in reversed(path)]
+
+    def report(self):
+        lines = [f"[图分析] 强连通分量 {len(self.sccs)} 个, 不可达状态 {len(self.unreachable)} 个, "
+                 f"死状态 {len(self.sinks)} 个, 陷阱分量 {len(self.traps)} 个"]
+        lines += [f"  不可达: {st}" for st in sorted(self.unreachable)]
+        lines += [f"  死状态: {st}" for st in sorted(self.sinks)]
+        lines += [f"  陷阱: {{{', '.join(sorted(c))}}}" for c in self.traps]
+        for v in sorted((v for v, d in enumerate(self.dist) if d > 0), key=lambda v: self.dist[v]):
+            lines.append(f"  最短路径 ({self.dist[v]} 步): {' -> '.join(self.path(v))}")
+        return lines
+
+class GraphIndex:
+    # 状态名映射为整数编号，邻接表以 Counter 记录平行边数量，按表格行增量维护
+    def __init__(self):
+        self.ids, self.names, self.succ, self.pred = {}, [], [], []
+        self.row_edges, self.row_keys = [], []
+        self.revision, self._cache = 0, None
+
+    def _id(self, name):
+        k = self.ids.get(name)
+        if k is None:
+            k = self.ids[name] = len(self.names)
+            self.names.append(name); self.succ.append(Counter()); self.pred.append(Counter())
+        return k
+
+    def _link(self, edge, d):
+        if not edge: return
+        s, t = edge; self.succ[s][t] += d; self.pred[t][s] += d
+        if not self.succ[s][t]: del self.succ[s][t]; del self.pred[t][s]
+
+    def set_row(self, r, src, dst):
+        if self.row_keys[r] == (src, dst): return
+        edge = (self._id(src), self._id(dst)) if src and dst else None
+        self._link(self.row_edges[r], -1); self._link(edge, 1)
+        self.row_edges[r], self.row_keys[r] = edge, (src, dst); self.revision += 1
+
+    def remove_row(self, r):
+        if r >= len(self.row_edges): return
+        self._link(self.row_edges.pop(r), -1); self.row_keys.pop(r); self.revision += 1
+
+    def sync(self, pairs):
+        while len(self.row_keys) > len(pairs): self.remove_row(len(self.row_keys) - 1)
+        while len(self.row_keys) < len(pairs): self.row_edges.append(None); self.row_keys.append(None)
+        for r, (src, dst) in enumerate(pairs): self.set_row(r, src, dst)
+
+    def analyze(self, states, reset):
+        key = (self.revision, reset, len(states))
+        if self._cache and self._cache[0] == key: return self._cache[1]
+        live = [self._id(st) for st in states]; n = len(self.names); succ = self.succ
+        dist, parent = [-1] * n, [-1] * n
+        root = self.ids.get(reset) if reset in states else None
+        if root is not None:
+            dist[root], frontier = 0, [root]
+            while frontier:
+                nxt = []
+                for v in frontier:
+                    for w in succ[v]:
+                        if dist[w] < 0: dist[w], parent[w] = dist[v] + 1, v; nxt.append(w)
+                frontier = nxt
+        sccs = self._tarjan(live)
+        comp = [-1] * n
+        for c, members in enumerate(sccs):
+            for v in members: comp[v] = c
+        closed = [True] * len(sccs)
+        for v in live:
+            for w in succ[v]:
+                if comp[w] != comp[v]: closed[comp[v]] = False
+        sinks = [v for v in live if not any(w != v for w in succ[v])]
+        traps = [c for k, c in enumerate(sccs) if closed[k] and len(c) > 1 and root not in c]
+        rep = GraphReport(self.names, live, root, dist, parent, sccs, sinks, traps)
+        self._cache = (key, rep)
+        return rep
+
+    def _tarjan(self, live):
+        n, succ = len(self.names), self.succ
+        index, low, on = [-1] * n, [0] * n, [False] * n
+        stack, comps, counter = [], [], 0
+        for root in live:
+            if index[root] >= 0: continue
+            index[root] = low[root] = counter; counter += 1; stack.append(root); on[root] = True
+            work = [(root, iter(succ[root]))]
+            while work:
+                v, it = work[-1]
+                for w in it:
+                    if index[w] < 0:
+                        index[w] = low[w] = counter; counter += 1; stack.append(w); on[w] = True
+                        work.append((w, iter(succ[w]))); break
+                    if on[w]: low[v] = min(low[v], index[w])
+                else:
+                    work.pop()
+                    if work: u = work[-1][0]; low[u] = min(low[u], low[v])
+                    if low[v] == index[v]:
+                        members = []
+                        while True:
+                            w = stack.pop(); on[w] = False; members.append(w)
+                            if w == v: break
+                        comps.append(members)
+        return comps
+
+# --- 11. 状态最小化：Hopcroft 划分细化 ---
+def minimize_fsm(model):
+    states = model.state_list; n = len(states); idx = {st: i for i, st in enumerate(states)}
+    out = [[] for _ in range(n)]
+    for s, d, c, a in model.rows:
+        if s and d: out[idx[s]].append((c.strip(), tuple(parse_actions(a)), idx[d]))
+    # 符号 k 为第 k 条跳转行，最后一个符号为无条件命中时的保持(自环)；初始划分按 (条件, 动作) 序列签名
+    delta = [[d for *_, d in o] + [i] for i, o in enumerate(out)]
+    blocks, block_of, by_sig = [], [0] * n, {}
+    waits = model.wait_counts()  # 带 wait 的状态进入时会重装计数器，合并后语义会变，单独成块
+    for i, o in enumerate(out):
+        b = by_sig.setdefault((tuple((c, a) for c, a, _ in o), i if states[i] in waits else -1), len(by_sig))
+        if b == len(blocks): blocks.append(set())
+        blocks[b].add(i); block_of[i] = b
+    n_sym = max((len(dl) for dl in delta), default=0)
+    inv = [{} for _ in range(n_sym)]
+    for i, dl in enumerate(delta):
+        for a, t in enumerate(dl): inv[a].setdefault(t, []).append(i)
+    work = {(b, a) for b in range(len(blocks)) for a in range(n_sym)}
+    while work:
+        b, a = work.pop(); hit = {}
+        for t in blocks[b]:
+            for s in inv[a].get(t, ()): hit.setdefault(block_of[s], set()).add(s)
+        for y, xs in hit.items():
+            if len(xs) == len(blocks[y]): continue
+            rest = blocks[y] - xs
+            small, big = (xs, rest) if len(xs) <= len(rest) else (rest, xs)
+            z = len(blocks); blocks[y] = big; blocks.append(small)
+            for s in small: block_of[s] = z
+            # 新块总是较小的一半：(y, c) 已在队列中时两半都需处理，否则只需处理较小的一半
+            for c in range(n_sym): work.add((z, c))
+    reset, rep, groups = model.reset_state(), {}, []
+    for blk in blocks:
+        head = reset if reset in idx and idx[reset] in blk else states[min(blk)]
+        for i in blk: rep[states[i]] = head
+        if len(blk) > 1: groups.append([head] + [states[i] for i in sorted(blk) if states[i] != head])
+    rows = [(s, rep.get(d, d), c, a) for s, d, c, a in model.rows if not s or rep.get(s, s) == s]
+    m = FSMModel(rows, model.params, reset, model.enc, model.enc_map, model.style, model.timing); m.meta = model.meta
+    return m, sorted(groups)
+
+# --- 12. 状态编码搜索：模拟退火，多进程并行 ---
+ENC_LOGIC_WEIGHT = 0.25  # 目标码字中 1 的个数，粗略对应次态逻辑的乘积项
+
+def encoding_cost(codes, edges):
+    return sum(w * (bin(codes[s] ^ codes[d]).count('1') + ENC_LOGIC_WEIGHT * bin(codes[d]).count('1')) for s, d, w in edges)
+
+def _anneal_encoding(n, width, edges, fixed, budget, seed):
+    rnd, pop, space = random.Random(seed), (lambda x: bin(x).count('1')), 1 << width
+    adj = [[] for _ in range(n)]
+    for s, d, w in edges: adj[s].append((d, w, True)); adj[d].append((s, w, False))
+    codes = rnd.sample(range(space), n)
+    if fixed is not None:
+        k = codes.index(0) if 0 in codes else None
+        if k is not None: codes[k] = codes[fixed]
+        codes[fixed] = 0
+    owner = [-1] * space
+    for v, c in enumerate(codes): owner[c] = v
+
+    def local(v, skip):
+        c, t = codes[v], 0.0
+        for u, w, out in adj[v]:
+            if u != skip: cu = codes[u]; t += w * (pop(c ^ cu) + ENC_LOGIC_WEIGHT * pop(cu if out else c))
+        return t
+
+    def between(v, u):
+        c, cu = codes[v], codes[u]
+        return sum(w * (pop(c ^ cu) + ENC_LOGIC_WEIGHT * pop(cu if out else c)) for x, w, out in adj[v] if x == u)
+
+    cost = encoding_cost(codes, edges); best, best_codes = cost, list(codes)
+    movable = [v for v in range(n) if v != fixed and adj[v]]
+    if not movable: return best, best_codes
+    t0 = time.perf_counter(); temp0 = 2.0 * max((w for *_, w in edges), default=1); temp = temp0; it = 0
+    while True:
+        it += 1
+        if not it & 255:
+            frac = (time.perf_counter() - t0) / budget
+            if frac >= 1: break
+            temp = temp0 * 0.001 ** frac
+        v = rnd.choice(movable); target = rnd.randrange(space); u = owner[target]
+        if u == v or u == fixed: continue
+        before = local(v, u) + (local(u, v) + between(v, u) if u >= 0 else 0)
+        old = codes[v]; codes[v] = target
+        if u >= 0: codes[u] = old
+        delta = local(v, u) + (local(u, v) + between(v, u) if u >= 0 else 0) - before
+        if delta <= 0 or rnd.random() < math.exp(-delta / temp):
+            owner[target] = v; owner[old] = u; cost += delta
+            if cost < best - 1e-9: best, best_codes = cost, list(codes)
+        else:
+            codes[v] = old
+            if u >= 0: codes[u] = target
+    return best, best_codes
+
+def optimize_encoding(model, weights=None, budget=2.0, workers=None):
+    states = model.state_list; idx = {st: i for i, st in enumerate(states)}; agg = Counter()
+    for r, (s, d, _, _) in enumerate(model.rows):
+        if s and d and s != d: agg[(idx[s], idx[d])] += weights[r] if weights else 1
+    edges = [(s, d, w) for (s, d), w in agg.items()]
+    width = max(1, math.ceil(math.log2(max(len(states), 2))))
+    workers = workers or min(os.cpu_count() or 1, 8)
+    # 每个进程独立退火（不同随机种子），取代价最低的方案
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futs = [pool.submit(_anneal_encoding, len(states), width, edges, idx.get(model.reset_state()), budget, seed)
+                for seed in range(workers)]
+        cost, codes = min((f.result() for f in futs), key=lambda r: r[0])
+    return dict(zip(states, codes)), cost, edges
+
+# --- 13. 资源估算：FF / LUT / 逻辑级数的解析模型 ---
+_COMPARE_OPS = ('==', '!=', '===', '!==', '<', '<=', '>', '>=')
+
+def infer_signal_widths(model):
+    params = evaluate_params(model.params); outs = set(model.outputs()); widths, sure, links = {}, set(), []
+    for text, act in [(c, False) for _, _, c, _ in model.rows] + [(a, True) for *_, a in model.rows]:
+        for name, kind, v in cell_width_hints(text, act):
+            if name in params or name == WAIT_KW: continue
+            if kind == 'ref' and v not in params: links.append((name, v)); continue
+            w = v if kind in ('w', 'min') else params[v][1] if kind == 'ref' else None
+            if kind == 'id': widths.setdefault(name, 1)
+            elif w: widths[name] = max(widths.get(name, 1), w)
+            if w and kind != 'min': sure.add(name)
+    # 信号之间比较或直接赋值 (a == b, po = din)：位宽不确定的一侧取另一侧的位宽，直到不再变化
+    changed = True
+    while changed:
+        changed = False
+        for a, b in links:
+            for x, y in ((a, b), (b, a)):
+                if x not in sure and x in widths and widths.get(y, 0) > widths[x]: widths[x] = widths[y]; changed = True
+    return {n: w for n, w in widths.items() if n in outs or n not in params}
+
+# 位宽确定的信号：出现过定宽常量比较、位选或参数引用；其余信号的推断位宽只是下限
+def sized_signals(model):
+    params = evaluate_params(model.params); sure = set()
+    for text, act in [(c, False) for _, _, c, _ in model.rows] + [(a, True) for *_, a in model.rows]:
+        for name, kind, v in cell_width_hints(text, act):
+            if (kind == 'w' and v) or (kind == 'ref' and v in params): sure.add(name)
+    return sure
+
+def _lut_cost(k, K):
+    if k <= 1: return 0, 0
+    if k <= K: return 1, 1
+    return math.ceil((k - 1) / (K - 1)), math.ceil(math.log(k) / math.log(K))
+
+def _func_cost(support, literals, K):
+    # 支持集不超过 K 时整个函数落在一个 LUT 内；否则按积之和的字面量总数估算 K 输入 LUT 树
+    if not literals: return 0, 0
+    if support <= K: return _lut_cost(support, K)
+    return _lut_cost(literals, K)
+
+def estimate_resources(model, modes=("Binary", "One-hot", "Gray"), widths=None):
+    widths = widths if widths is not None else infer_signal_widths(model)
+    states = model.state_list; idx = {st: i for i, st in enumerate(states)}; n = len(states)
+    outs = model.outputs(); out_set = set(outs); memo = {}
+    def names_of(text):
+        if text not in memo:
+            try: memo[text] = frozenset(v for kind, v in tokenize_expr(text) if kind == 'id' and v in widths and v not in out_set)
+            except ValueError: memo[text] = frozenset()
+        return memo[text]
+    bits = lambda names: sum(widths[x] for x in names)
+    # 每个状态的跳转行 (目标, 含更高优先级条件在内的输入, 其位数)，无条件行之后的行不可能命中
+    trans, hold, rules = [[] for _ in range(n)], [True] * n, {}
+    for s, d, c, a in model.rows:
+        if not (s and d): continue
+        i = idx[s]
+        if hold[i]:
+            names = (trans[i][-1][1] if trans[i] else frozenset()) | names_of(c)
+            trans[i].append((idx[d], names, bits(names)))
+            if is_unconditional(c): hold[i] = False
+        for k, v in parse_actions(a): rules.setdefault(k, {}).setdefault(i, set()).update(names_of(c) | names_of(v))
+    all_in = [t[-1][1] if t else frozenset() for t in trans]
+    all_bits = [bits(x) for x in all_in]
+    # 每个 (目标, 源状态) 的乘积项：源状态译码 & 到最后一条去往该目标的行为止的条件输入
+    into = [{} for _ in range(n)]
+    for i, t in enumerate(trans):
+        for j, names, _ in t: into[j][i] = names
+        if hold[i]: into[i][i] = all_in[i]
+    waits = model.wait_counts(); cw = wait_width(waits) if waits else 0
+    res = {}
+    for mode in modes:
+        w, _, codes = state_encoding(states, mode, model.enc_map)
+        onehot = mode == "One-hot"
+        # (支持集位数, 积之和字面量总数, 需要完整译码的状态)；二进制类编码的状态译码在各函数间共享
+        funcs = []
+        if onehot:
+            for j in range(n):
+                ins = frozenset().union(*into[j].values())
+                funcs.append((len(into[j]) + bits(ins), sum(1 + bits(x) for x in into[j].values()), ()))
+        else:
+            for b in range(w):
+                lits, used, dec = 0, set(), []
+                for i in range(n):
+                    vals = [(codes[j] >> b) & 1 for j, _, _ in trans[i]]
+                    if hold[i]: vals.append((codes[i] >> b) & 1)
+                    if 1 not in vals: continue
+                    dec.append(i)
+                    if 0 not in vals: lits += 1; continue
+                    last = len(vals) - 1 - vals[::-1].index(1)
+                    lits += 1 + (all_bits[i] if last >= len(trans[i]) else trans[i][last][2]); used |= all_in[i]
+                funcs.append((w + bits(used), lits, dec))
+        for k in outs:
+            if k not in rules: continue  # 只出现在未填完整的行里：寄存器恒保持，不需要逻辑
+            per_state = rules[k]; used = frozenset().union(*per_state.values())
+            lits = sum(1 + bits(x) for x in per_state.values()) + 2  # +2: 保持时的寄存器反馈
+            support = (len(per_state) if onehot else w) + bits(used) + 1
+            funcs += [(support, lits, () if onehot else per_state)] * widths.get(k, 1)
+        est = {"ff": w + sum(widths.get(k, 1) for k in outs) + cw}
+        for K in (4, 6):
+            dec_cost = _lut_cost(w, K); decoded, luts, depth = set(), 0, 0
+            for support, lits, dec in funcs:
+                c, d = _func_cost(support, lits, K); luts += c
+                if support > K and dec: decoded.update(dec); d += dec_cost[1]
+                depth = max(depth, d)
+            # 等待计数器：每位一个递减/装入 LUT，再加一棵判零树
+            est[f"lut{K}"] = luts + len(decoded) * dec_cost[0] + (cw + _lut_cost(cw, K)[0] if cw else 0); est[f"depth{K}"] = depth
+        res[mode] = est
+    return res
+
+# --- 14. 查表实现：次态/输出 ROM 映像 + $readmemh 封装模块 ---
+ROM_MAX_ADDR_BITS = 20
+RomGeometry = namedtuple("RomGeometry", "sw iw aw dw fields")  # fields: (输出, 使能位, 值最低位, 位宽)
+
+def rom_layout(states, inputs, outputs, out_widths):
+    sw = max(1, math.ceil(math.log2(len(states)))); iw = sum(w for _, w in inputs)
+    # 数据字由低到高：次态 | 每个输出的 {使能, 值}；使能为 0 时输出保持原值
+    fields, pos = [], sw
+    for n, w in zip(outputs, out_widths): fields.append((n, pos + w, pos, w)); pos += w + 1
+    return RomGeometry(sw, iw, sw + iw, pos, fields)
+
+def rom_geometry(sim):
+    return rom_layout(sim.states, sim.inputs, sim.outputs, sim.out_widths)
+
+def build_rom(sim, progress=None):
+    g = rom_geometry(sim)
+    if sim.model.wait_counts(): raise ValueError("含 wait(N) 计数等待的状态机暂不支持查表实现")
+    if g.aw > ROM_MAX_ADDR_BITS: raise ValueError(f"ROM 地址 {g.aw} 位 (状态 {g.sw} + 输入 {g.iw}) 超出上限 {ROM_MAX_ADDR_BITS} 位")
+    # 地址 {state, 输入...}：第一个输入在高位，与 Verilog 拼接顺序一致
+    vecs = [[]]
+    for _, w in sim.inputs: vecs = [vec + [v] for vec in vecs for v in range(1 << w)]
+    masks = [(1 << w) - 1 for w in sim.out_widths]; zeros = [0] * len(masks)
+    words = array('Q') if g.dw <= 64 else []
+    for k, st in enumerate(sim.states):
+        step = sim._steps[k]
+        for vec in vecs:
+            # 输出寄存器取全 0 与全 1 各求一次：两次都等于原值为保持，两次相同为与寄存器无关的赋值
+            lo, hi = list(zeros), list(masks)
+            n0, _ = step(vec, lo); n1, _ = step(vec, hi)
+            if n0 != n1: raise ValueError(f"状态 {st} 的跳转条件引用了输出寄存器，无法查表实现")
+            word = n0
+            for (n, en, low, _), a, b, m in zip(g.fields, lo, hi, masks):
+                if a == 0 and b == m: continue
+                if a != b: raise ValueError(f"状态 {st} 中输出 {n} 的取值依赖其自身寄存器，无法查表实现")
+                word |= (1 << en) | (a << low)
+            words.append(word)
+        if progress: progress(k + 1, len(sim.states))
+    # 未使用的状态码一律回到复位状态
+    words.extend([sim.states.index(sim.model.reset_state())] * ((1 << g.aw) - len(words)))
+    return g, words
+
+def build_rom_wrapper(sim, g, mem="fsm_rom.mem", name="fsm_rom"):
+    rs = sim.states.index(sim.model.reset_state())
+    ports = ["    input  wire sys_clk,", "    input  wire sys_rst_n,"]
+    ports += [f"    input  wire {_vec(w)}{n}," for n, w in sim.inputs]
+    ports += [f"    output wire {_vec(w)}{n}," for n, _, _, w in g.fields]
+    ports[-1] = ports[-1].rstrip(',')
+    reset_word = rs | sum(1 << en for _, en, _, _ in g.fields)
+    addr = "{" + ", ".join(["state"] + [n for n, _ in sim.inputs]) + "}"
+    code = [f"// 查表实现：次态与输出由 {mem} 初始化的 ROM 给出，地址 = {addr}", f"module {name} (", *ports, ");",
+            f"    localparam AW = {g.aw};", f"    localparam DW = {g.dw};", "",
+            "    (* rom_style = \"block\" *) reg [DW-1:0] rom [0:(1<<AW)-1];", f"    initial $readmemh(\"{mem}\", rom);", "",
+            "    // ROM 同步读出的数据字即状态寄存器 (同步复位，便于映射到 Block RAM 输出寄存器)",
+            "    reg  [DW-1:0] word;", f"    wire [{g.sw-1}:0] state = word[{g.sw-1}:0];", "",
+            "    always@(posedge sys_clk) begin", "        if(sys_rst_n == 1'b0)",
+            f"            word <= {g.dw}'h{reset_word:x};", "        else", f"            word <= rom[{addr}];", "    end", ""]
+    for n, en, low, w in g.fields:
+        code += [f"    // Output: {n}", f"    reg  {_vec(w)}{n}_hold;",
+                 f"    assign {n} = word[{en}] ? word[{en - 1}:{low}] : {n}_hold;",
+                 f"    always@(posedge sys_clk) {n}_hold <= {n};", ""]
+    code.append("endmodule")
+    return "\n".join(code)
+
+def write_rom(sim, out_dir, progress=None):
+    g, words = build_rom(sim, progress)
+    os.makedirs(out_dir, exist_ok=True); paths = [os.path.join(out_dir, f) for f in ("fsm_rom.v", "fsm_rom.mem")]
+    digits = max(1, (g.dw + 3) // 4); fmt = f"0{digits}x"
+    with open(paths[1], 'w', encoding='utf-8') as f_out:
+        for k in range(0, len(words), 65536): f_out.write("".join(format(v, fmt) + "\n" for v in words[k:k + 65536]))
+    with open(paths[0], 'w', encoding='utf-8') as f_out: f_out.write(build_rom_wrapper(sim, g) + "\n")
+    return g, paths
+
+# --- 15. 状态机分解：按跳转图划分为若干互相移交控制权的子状态机 ---
+# 任一时刻只有一个子状态机处于非空闲状态；跨块跳转时源状态机回到空闲并给出目标状态的全局编号，
+# 目标状态机在同一时钟沿进入该状态，因此分解后的时序与原状态机逐周期一致
+DECOMP_IDLE = "P_IDLE"
+
+def partition_states(model, k, passes=6, slack=1.15):
+    states = model.state_list; n = len(states); idx = {st: i for i, st in enumerate(states)}
+    adj, succ = [Counter() for _ in range(n)], [[] for _ in range(n)]
+    for s, d, _, _ in model.rows:
+        if s and d and s != d: adj[idx[s]][idx[d]] += 1; adj[idx[d]][idx[s]] += 1; succ[idx[s]].append(idx[d])
+    # 从复位状态沿跳转深度优先排序后按顺序切块，顺序执行的状态链天然落在同一块中
+    order, seen = [], [False] * n
+    for root in [idx.get(model.reset_state(), 0)] + list(range(n)):
+        stack = [root]
+        while stack:
+            i = stack.pop()
+            if seen[i]: continue
+            seen[i] = True; order.append(i); stack += reversed(succ[i])
+    size = math.ceil(n / k); part = [0] * n
+    for pos, i in enumerate(order): part[i] = pos // size
+    # 逐点移动到连接最多的相邻块以减少跨块跳转，块大小不超过均分的 slack 倍
+    cap, counts = math.ceil(size * slack), Counter(part)
+    for _ in range(passes):
+        moved = 0
+        for i in order:
+            gain = Counter()
+            for j, w in adj[i].items(): gain[part[j]] += w
+            cur = part[i]; best = max(gain, key=lambda b: (gain[b], b == cur), default=cur)
+            if best != cur and gain[best] > gain[cur] and counts[best] < cap and counts[cur] > 1:
+                counts[cur] -= 1; counts[best] += 1; part[i] = best; moved += 1
+        if not moved: break
+    blocks = {}
+    for i, b in enumerate(part): blocks.setdefault(b, []).append(states[i])
+    return [blocks[b] for b in sorted(blocks)]
+
+def part_model(model, block, gid, gw):
+    # 估算用的子状态机：出块跳转改为回到空闲，入块状态由空闲按移交编号进入
+    inside = set(block); rows, entries = [], set()
+    for s, d, c, a in model.rows:
+        if s in inside: rows.append((s, d if d in inside else DECOMP_IDLE, c, a))
+        elif s and d in inside: entries.add(d)
+    rows += [(DECOMP_IDLE, t, f"xfer_in == {gw}'d{gid[t]}", "") for t in sorted(entries)]
+    return FSMModel(rows, model.params, model.reset if model.reset in inside else DECOMP_IDLE)
+
+def decompose_fsm(model, max_parts=8):
+    if model.wait_counts(): raise ValueError("含 wait(N) 计数等待的状态机暂不支持分解")
+    if DECOMP_IDLE in model.state_list: raise ValueError(f"状态名 {DECOMP_IDLE} 为分解保留名")
+    gid = {st: k + 1 for k, st in enumerate(model.state_list)}; gw = len(model.state_list).bit_length()
+    widths = infer_signal_widths(model)
+    base = estimate_resources(model, ("Binary",), widths)["Binary"]
+    scores, best = {1: (base["depth6"], base["lut6"], 0)}, (1, [list(model.state_list)])
+    for k in range(2, min(max_parts, len(model.state_list) // 2) + 1):
+        parts = partition_states(model, k)
+        if len(parts) < 2: continue
+        est = [estimate_resources(part_model(model, b, gid, gw), ("Binary",), dict(widths, xfer_in=gw))["Binary"] for b in parts]
+        where = {st: j for j, b in enumerate(parts) for st in b}
+        cut = sum(1 for s, d, _, _ in model.rows if s and d and where[s] != where[d])
+        # 评分：各子状态机的最大逻辑级数 + 移交总线的或门树，其次看 LUT 总数
+        depth = max(e["depth6"] for e in est) + _lut_cost(len(parts), 6)[1]
+        scores[len(parts)] = (depth, sum(e["lut6"] for e in est) + gw * _lut_cost(len(parts), 6)[0], cut)
+        # 只有逻辑级数确实低于单一状态机时才分解；级数相同的候选再比 LUT 数与跨块跳转数
+        sc = scores[len(parts)]
+        if sc[0] < scores[1][0] and (best[0] == 1 or sc < scores[best[0]]): best = (len(parts), parts)
+    return best[1], scores
+
+def _part_info(model, block):
+    inside = set(block); rows = [r for r in model.rows if r[0] in inside]; used = set()
+    for _, _, c, a in rows:
+        for t in [c] + [v for _, v in parse_actions(a)]:
+            try: used |= {v for kind, v in tokenize_expr(t) if kind == 'id'}
+            except ValueError: pass
+    louts = [k for k in model.outputs() if any(k == n for *_, a in rows for n, _ in parse_actions(a))]
+    return inside, rows, used, louts
+
+def build_decomposed_verilog(model, parts):
+    widths = infer_signal_widths(model); outs = model.outputs(); inputs = model.inputs()
+    gid = {st: k + 1 for k, st in enumerate(model.state_list)}; gw = len(model.state_list).bit_length()
+    rs, info = model.reset_state(), [_part_info(model, b) for b in parts]
+    cond = lambda c: c if c.strip() else "1'b1"
+    chain = lambda head, m, c: f"{head}{'if' if m == 0 else 'else if'}({cond(c)})"
+    params = [f"    parameter   {n.ljust(15)} = {v};" for n, v, _ in model.params if n]
+    code = [f"/*== 状态机分解：{len(parts)} 个子状态机，经 xfer 总线移交控制权 (0 表示无移交) ==*/", ""]
+    for j, (block, (inside, rows, used, louts)) in enumerate(zip(parts, info)):
+        lw = max(1, len(block).bit_length()); ind = " " * 16
+        code += [f"// 子状态机 {j}: {', '.join(block)}", f"module fsm_part{j} (", "    input  wire sys_clk,", "    input  wire sys_rst_n,"]
+        code += [f"    input  wire {_vec(widths.get(n, 1))}{n}," for n in inputs + outs if n in used]
+        code += [f"    input  wire [{gw-1}:0] xfer_in,", f"    output reg  [{gw-1}:0] xfer_out,"]
+        code += [f"    output reg  {k}_en,\n    output reg  {_vec(widths.get(k, 1))}{k}_val," for k in louts]
+        code[-1] = code[-1].rstrip(','); code.append(");")
+        code += params + [f"    parameter   {DECOMP_IDLE.ljust(15)} = {lw}'d0;"]
+        code += [f"    parameter   {st.upper().ljust(15)} = {lw}'d{k + 1};" for k, st in enumerate(block)]
+        code += [f"    reg [{lw-1}:0] state, next_state;", ""]
+        by_state = {}
+        for r in rows: by_state.setdefault(r[0], []).append(r)
+        trans = {st: [r for r in by_state.get(st, []) if r[1]] for st in block}
+        entries = sorted({d for s, d, _, _ in model.rows if s and s not in inside and d in inside})
+        code += ["    always@(*) begin", "        next_state = state;", "        case(state)", f"            {DECOMP_IDLE}: case(xfer_in)"]
+        code += [f"                {gw}'d{gid[t]}: next_state = {t.upper()};" for t in entries]
+        code.append("                default: next_state = state;\n            endcase")
+        for st in block:
+            if not trans[st]: continue
+            code.append(f"            {st.upper()}: begin")
+            for m, (_, d, c, _) in enumerate(trans[st]):
+                code.append(f"{chain(ind, m, c)}\n{ind}    next_state = {d.upper() if d in inside else DECOMP_IDLE};")
+            code.append("            end")
+        code += ["            default: next_state = state;", "        endcase", "    end", ""]
+        # 移交目标单独成块：它不依赖 xfer_in，避免与次态逻辑在结构上形成组合环
+        code += ["    always@(*) begin", f"        xfer_out = {gw}'d0;", "        case(state)"]
+        for st in block:
+            if all(d in inside for _, d, _, _ in trans[st]): continue
+            code.append(f"            {st.upper()}: begin")
+            for m, (_, d, c, _) in enumerate(trans[st]):
+                code.append(f"{chain(ind, m, c)}\n{ind}    xfer_out = {gw}'d{0 if d in inside else gid[d]};")
+            code.append("            end")
+        code += [f"            default: xfer_out = {gw}'d0;", "        endcase", "    end", ""]
+        code += ["    always@(posedge sys_clk or negedge sys_rst_n) begin", "        if(sys_rst_n == 1'b0)",
+                 f"            state <= {rs.upper() if rs in inside else DECOMP_IDLE};", "        else", "            state <= next_state;", "    end", ""]
+        for k in louts:
+            code += ["    always@(*) begin", f"        {k}_en = 1'b0; {k}_val = 'd0;", "        case(state)"]
+            for st in block:
+                rules = [(c, v) for _, _, c, a in by_state.get(st, []) for v in [next((v for n, v in parse_actions(a) if n == k), None)] if v is not None]
+                if not rules: continue
+                code.append(f"            {st.upper()}: begin")
+                code += [f"{chain(ind, m, c)} begin\n{ind}    {k}_en = 1'b1; {k}_val = {v};\n{ind}end" for m, (c, v) in enumerate(rules)]
+                code.append("            end")
+            code += ["            default: ;", "        endcase", "    end", ""]
+        code += ["endmodule", ""]
+    # 顶层：移交总线为各子状态机输出的按位或，输出寄存器取当前活动子状态机给出的值
+    code += ["module fsm_top (", "    input  wire sys_clk,", "    input  wire sys_rst_n,"]
+    code += [f"    input  wire {_vec(widths.get(n, 1))}{n}," for n in inputs]
+    code += [f"    output reg  {_vec(widths.get(k, 1))}{k}," for k in outs]
+    code[-1] = code[-1].rstrip(','); code.append(");")
+    for j, (*_, louts) in enumerate(info):
+        code.append(f"    wire [{gw-1}:0] p{j}_xfer;")
+        code += [f"    wire p{j}_{k}_en;\n    wire {_vec(widths.get(k, 1))}p{j}_{k}_val;" for k in louts]
+    code.append(f"    wire [{gw-1}:0] xfer = " + " | ".join(f"p{j}_xfer" for j in range(len(parts))) + ";\n")
+    for j, (inside, rows, used, louts) in enumerate(info):
+        conns = [".sys_clk(sys_clk)", ".sys_rst_n(sys_rst_n)"] + [f".{n}({n})" for n in inputs + outs if n in used]
+        conns += [".xfer_in(xfer)", f".xfer_out(p{j}_xfer)"] + [f".{k}_en(p{j}_{k}_en), .{k}_val(p{j}_{k}_val)" for k in louts]
+        code.append(f"    fsm_part{j} u_part{j} ({', '.join(conns)});")
+    code.append("")
+    for k in outs:
+        code += ["    always@(posedge sys_clk or negedge sys_rst_n) begin", f"        if(sys_rst_n == 1'b0)\n            {k} <= 'b0;"]
+        code += [f"        else if(p{j}_{k}_en)\n            {k} <= p{j}_{k}_val;" for j, (*_, louts) in enumerate(info) if k in louts]
+        code.append("    end")
+    code.append("endmodule")
+    return "\n".join(code)
+
+# --- 16. 状态图：构建 Graphviz 图 / 分页 / 矢量与分块位图导出 ---
+Diagram = namedtuple("Diagram", "dot nodes edges hidden")  # edges: [(可见源, 可见目标, [表格行号])]; hidden: {折叠内部行: 所在节点}
+
+def diagram_graph(rows, reset="", expanded=(), entries=None, bundle=False, cut=0, heat=None, style=None, only=None):
+    dot = graphviz.Digraph(format='png'); dot.attr(rankdir='LR', fontname='Microsoft YaHei')
+    keep = [i for i in range(len(rows)) if only is None or i in only]
+    states = sorted({x for i in keep for x in rows[i][:2] if x}); entries = entries or {}
+    edges, hidden, conds, children = {}, {}, [(s, c) for s, _, c, _ in rows if s], hier_tree(states)
+    if children: dot.attr(compound='true')
+    def show(x):  # 最外层未展开的祖先代表该状态
+        return next((p for p in hier_parents(x) if p not in expanded), x)
+    def anchor(x):  # 已展开的超状态以其入口子状态作为连线端点
+        if x not in children: return x, None
+        return show(hier_entry(x, children, entries)), f"cluster_{x}"
+    for i in keep:
+        s, n, c, a = rows[i]
+        if s and n:
+            vs, vn = show(s), show(n)
+            if vs == vn and vs != s: hidden[i] = vs; continue  # 折叠超状态的内部跳转
+            (vs, tail), (vn, head) = anchor(vs), anchor(vn)
+            ends = {**({'ltail': tail} if tail else {}), **({'lhead': head} if head and vs != vn else {})}
+            edges.setdefault((vs, vn, tail, head) if bundle else i, (vs, vn, ends, []))[3].append((i, c, a))
+    legend = []
+    for vs, vn, ends, items in edges.values():  # 合并模式下同一对端点的多行只画一条边，条件列入图例
+        if len(items) == 1: label = edge_label(items[0][1], items[0][2], cut)
+        else:
+            legend.append(f"[{len(legend) + 1}] {vs} → {vn}: " + "; ".join(edge_label(c, a, cut).replace("\n", " ") for _, c, a in items))
+            label = f"[{len(legend)}] ×{len(items)}"
+        hot = max((heat[1][i] for i, _, _ in items), key=lambda h: float(h['penwidth'])) if heat else {}
+        dot.edge(vs, vn, label=label, fontname='Microsoft YaHei', **ends, **hot)
+    if legend: dot.node("__legend__", label="\\l".join(legend) + "\\l", shape='note', fontname='Microsoft YaHei', fontsize='10')
+    waits, shown = wait_counts(conds, False), []
+    def node(g, state):
+        shown.append(state); label = state.rsplit(HIER_SEP, 1)[-1] + (f"\n⏱ {waits[state]} 拍" if state in waits else "")  # 计数等待状态：节点加注释
+        if state in children:
+            leaves = sum(1 for x in states if x.startswith(state + HIER_SEP) and x not in children)
+            g.node(state, label=f"{label}\n[{leaves} 个子状态]", shape='box3d', style='filled', fillcolor='lightyellow',
+                   peripheries='2' if state == reset else '1')
+        elif heat: g.node(state, label=label, shape='doublecircle' if state == reset else 'circle', style='filled', **heat[0].get(hier_flat(state), {}))
+        elif state == reset: g.node(state, label=label, shape='doublecircle', color='darkgreen', style='filled', fillcolor='honeydew')
+        else: g.node(state, label=label, **{'shape': 'circle', 'style': 'filled', 'fillcolor': 'lightblue', **(style(state) if style else {})})
+    def emit(g, items):
+        for x in items:
+            if x in children and x in expanded:
+                with g.subgraph(name=f"cluster_{x}") as sub:
+                    sub.attr(label=x, style='rounded,dashed', color='gray50'); emit(sub, children[x])
+            else: node(g, x)
+    emit(dot, list(dict.fromkeys(x.split(HIER_SEP)[0] for x in states)))
+    return Diagram(dot, shown, [(vs, vn, [i for i, _, _ in items]) for vs, vn, _, items in edges.values()], hidden)
+
+# 网格空间索引：图元按包围盒登记到固定大小的格子里，点击命中只检查所在格子，与图元总数无关
+class DiagramIndex:
+    PAD = 4.0  # Graphviz 默认页边距 (pt)
+
+    def __init__(self, layout, cell=72.0, tol=6.0):
+        x0, y0, x1, y1 = map(float, layout["bb"].split(","))
+        self.box, self.cell, self.tol, self.grid, self.shapes = (x0 - self.PAD, y0 - self.PAD, x1 + self.PAD, y1 + self.PAD), cell, tol, {}, {}
+        objs = layout.get("objects", []); names = {o["_gvid"]: o["name"] for o in objs}
+        for o in objs:
+            if "pos" not in o: continue  # 子图 (cluster) 只有 bb
+            x, y = map(float, o["pos"].split(",")); w, h = 36 * float(o.get("width", 0.1)), 36 * float(o.get("height", 0.1))
+            self.add(("node", o["name"]), x - w, y - h, x + w, y + h, True)
+        for e in layout.get("edges", []):
+            key = ("edge", names[e["tail"]], names[e["head"]])
+            for spline in e.get("pos", "").split(";"):
+                pts, head, tail = [], [], []
+                for tok in spline.split():
+                    f = tok.split(",")
+                    if f[0] == "s": head = [(float(f[1]), float(f[2]))]
+                    elif f[0] == "e": tail = [(float(f[1]), float(f[2]))]
+                    else: pts.append((float(f[0]), float(f[1])))
+                pts = head + pts + tail
+                for (ax, ay), (bx, by) in zip(pts, pts[1:]): self.add(key, ax, ay, bx, by, False)
+            if "lp" in e:
+                lx, ly = map(float, e["lp"].split(",")); self.add(key, lx - 24, ly - 10, lx + 24, ly + 10, True)
+
+    def add(self, key, ax, ay, bx, by, box):
+        item, c, t = (key, box, ax, ay, bx, by), self.cell, 0 if box else self.tol
+        self.shapes.setdefault(key, []).append(item)
+        for cx in range(int((min(ax, bx) - t) // c), int((max(ax, bx) + t) // c) + 1):
+            for cy in range(int((min(ay, by) - t) // c), int((max(ay, by) + t) // c) + 1): self.grid.setdefault((cx, cy), []).append(item)
+
+    def to_image(self, x, y):
+        x0, y0, x1, y1 = self.box
+        return (x - x0) / (x1 - x0), (y1 - y) / (y1 - y0)
+
+    def hit(self, u, v):  # u, v 为图像内归一化坐标 (左上角为原点)；节点优先，其次最近的边
+        x0, y0, x1, y1 = self.box; x, y = x0 + u * (x1 - x0), y1 - v * (y1 - y0); best = None
+        for key, box, ax, ay, bx, by in self.grid.get((int(x // self.cell), int(y // self.cell)), ()):
+            if box:
+                if not (min(ax, bx) <= x <= max(ax, bx) and min(ay, by) <= y <= max(ay, by)): continue
+                d = 0.0
+            else:
+                dx, dy = bx - ax, by - ay; k = max(0.0, min(1.0, ((x - ax) * dx + (y - ay) * dy) / ((dx * dx + dy * dy) or 1.0)))
+                d = math.hypot(x - ax - k * dx, y - ay - k * dy)
+                if d > self.tol: continue
+            rank = (key[0] != "node", d)
+            if best is None or rank < best[0]: best = (rank, key)
+        return best[1] if best else None
+
+# 分页：hierarchy 为总览页加每个顶层超状态一页，components 按连通分量各一页；返回 [(文件名后缀, 行号集合, 展开的超状态)]
+def diagram_pages(rows, mode="none", expanded=()):
+    states = {x for r in rows for x in r[:2] if x}; children = hier_tree(states)
+    live = [i for i, r in enumerate(rows) if r[0] and r[1]]
+    if mode == "hierarchy" and children:
+        pages = [("top", None, ())]
+        for p in (q for q in children if HIER_SEP not in q):
+            inside = lambda x: x == p or x.startswith(p + HIER_SEP)
+            only = {i for i in live if inside(rows[i][0]) and inside(rows[i][1])}
+            if only: pages.append((hier_flat(p), only, tuple(q for q in children if inside(q))))
+        return pages
+    if mode == "components":
+        root = {}
+        def find(x):
+            while root.setdefault(x, x) != x: root[x] = root[root[x]]; x = root[x]
+            return x
+        for x in states:  # 同一超状态下的子状态始终在同一页
+            for p in hier_parents(x): root[find(x)] = find(p)
+        for i in live: root[find(rows[i][0])] = find(rows[i][1])
+        comps = {}
+        for i in live: comps.setdefault(find(rows[i][0]), set()).add(i)
+        if len(comps) > 1: return [(f"c{k + 1}", only, expanded) for k, only in enumerate(sorted(comps.values(), key=len, reverse=True))]
+    return [("", None, expanded)]
+
+def _run_graphviz(args, source):
+    return subprocess.run(args, input=source.encode('utf-8'), capture_output=True, check=True).stdout
+
+# 流式写 PNG：逐行压缩写出 IDAT，内存中不保留整幅位图
+def write_png(path, width, height, lines, flush=1 << 20):
+    with open(path, 'wb') as f_out:
+        def chunk(tag, data): f_out.write(struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data)))
+        f_out.write(b"\x89PNG\r\n\x1a\n"); chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        z, buf, size = zlib.compressobj(6), [], 0
+        for line in lines:
+            buf.append(z.compress(b"\0" + line)); size += len(buf[-1])
+            if size >= flush: chunk(b"IDAT", b"".join(buf)); buf, size = [], 0
+        chunk(b"IDAT", b"".join(buf) + z.flush()); chunk(b"IEND", b"")
+
+# 超大 PNG：先用 dot 布局一次得到坐标，再用 neato -n2 + viewport 按块光栅化，每次只保留一行块
+def export_png_tiled(dot, path, scale=1.0, tile=1024, progress=None):
+    laid = _run_graphviz([dot.engine, "-Tdot"], dot.source).decode('utf-8')
+    x0, y0, x1, y1 = map(float, re.search(r'\bbb="([^"]+)"', laid).group(1).split(','))
+    width, height = max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale))
+    total, done = -(-width // tile) * -(-height // tile), [0]
+    def band(top):
+        th, imgs = min(tile, height - top), []
+        for left in range(0, width, tile):
+            tw = min(tile, width - left)
+            vp = f"{tw},{th},{scale},{x0 + (left + tw / 2) / scale},{y1 - (top + th / 2) / scale}"
+            png = _run_graphviz(["neato", "-n2", "-Tpng", "-Gdpi=72", "-Gpad=0", f"-Gviewport={vp}"], laid)
+            imgs.append((QImage.fromData(png).convertToFormat(QImage.Format_RGB888), tw))
+            done[0] += 1
+            if progress and progress(done[0], total): raise InterruptedError("已取消")
+        for y in range(th):
+            line = b""
+            for img, tw in imgs:  # 块尺寸与预期差一两个像素时按白色补齐
+                row = bytes(img.constScanLine(y))[:3 * tw] if y < img.height() else b""
+                line += row + b"\xff" * (3 * tw - len(row))
+            yield line
+    write_png(path, width, height, (line for top in range(0, height, tile) for line in band(top)))
+    return width, height
+
+def export_diagram(rows, path, reset="", pages="none", expanded=(), entries=None, scale=1.0, tile=1024, bundle=False, cut=0, progress=None):
+    base, ext = os.path.splitext(path); fmt = ext[1:].lower()
+    if fmt not in ("svg", "pdf", "png"): raise ValueError(f"不支持的导出格式: {ext or '(无扩展名)'}")
+    out = []
+    for suffix, only, exp in diagram_pages(rows, pages, expanded):
+        d = diagram_graph(rows, reset, exp, entries, bundle, cut, only=only)
+        if not d.edges: continue
+        target = f"{base}_{suffix}{ext}" if suffix else path
+        if fmt == "png": export_png_tiled(d.dot, target, scale, tile, progress)
+        else: _run_graphviz([d.dot.engine, f"-T{fmt}", "-o", target], d.dot.source)
+        out.append(target)
+    return out
+
+# --- 17. 命令行入口 ---
+def run_cli(argv):
+    parser = argparse.ArgumentParser(prog="fsm1_0_0.py", description="FPGA 状态机设计工具命令行模式")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("replay", help="按工程逻辑回放二进制输入 Trace")
+    p.add_argument("project"); p.add_argument("trace"); p.add_argument("output")
+    p.add_argument("--layout", help="Trace 布局, 如 'pi_data:1, pi_en:1' (默认取工程中保存的布局)")
+    p.add_argument("--chunk", type=int, default=65536, help="每块记录数")
+    p.add_argument("--vcd", help="同时导出 VCD 波形文件")
+    p.add_argument("--coverage", action="store_true", help="打印逐行覆盖率报告")
+    p = sub.add_parser("rom", help="生成查表实现：ROM 映像 (.mem) 与 $readmemh 封装模块")
+    p.add_argument("project"); p.add_argument("outdir")
+    p.add_argument("--layout", help="输入信号布局, 如 'pi_data:1, pi_en:1'")
+    p = sub.add_parser("decompose", help="自动分解为若干子状态机并输出 Verilog")
+    p.add_argument("project"); p.add_argument("output")
+    p.add_argument("--max-parts", type=int, default=8, help="子状态机数量上限")
+    p = sub.add_parser("diagram", help="导出状态图：SVG / PDF，或分块渲染的大尺寸 PNG")
+    p.add_argument("project"); p.add_argument("output", help="输出文件，扩展名决定格式 (.svg / .pdf / .png)")
+    p.add_argument("--pages", choices=("none", "hierarchy", "components"), default="none", help="分页方式：不分页 / 按顶层超状态 / 按连通分量")
+    p.add_argument("--scale", type=float, default=1.0, help="PNG 缩放倍数 (1 = 72 dpi)")
+    p.add_argument("--tile", type=int, default=1024, help="PNG 分块边长 (像素)，决定内存占用")
+    p.add_argument("--expand", action="store_true", help="展开全部超状态 (默认沿用工程中保存的展开状态)")
+    p.add_argument("--bundle", action="store_true", help="合并平行边，条件列入图例")
+    p.add_argument("--label-max", type=int, default=0, help="边标签截断长度 (0 为不截断)")
+    p = sub.add_parser("testbench", help="生成自检 Verilog Testbench 与 $readmemh 向量文件")
+    p.add_argument("project"); p.add_argument("outdir")
+    p.add_argument("--vectors", type=int, default=10000, help="向量数 (使用 Trace 时为上限)")
+    p.add_argument("--seed", type=int, help="随机种子")
+    p.add_argument("--trace", help="使用二进制 Trace 作为激励 (代替随机激励)")
+    p.add_argument("--layout", help="输入信号布局, 如 'pi_data:1, pi_en:1'")
+    args = parser.parse_args(argv)
+    model = FSMModel.from_project(args.project)
+    if args.cmd == "decompose":
+        parts, scores = decompose_fsm(model, args.max_parts)
+        for k, (d, l, c) in sorted(scores.items()): print(f"{k} parts: depth {d}, lut6 {l}, cut {c}")
+        with open(args.output, 'w', encoding='utf-8') as f_out:
+            f_out.write((build_decomposed_verilog(model, parts) if len(parts) > 1 else build_verilog(model)) + "\n")
+        print(f"{len(parts)} parts -> {args.output}")
+        return 0
+    if args.cmd == "diagram":
+        c, rows = model.meta, model.tree_rows
+        expanded = list(hier_tree({x for r in rows for x in r[:2] if x})) if args.expand else c.get("expanded", [])
+        paths = export_diagram(rows, args.output, c.get("reset", ""), args.pages, expanded, model.entries, args.scale, args.tile,
+                               args.bundle, args.label_max)
+        print(", ".join(paths) or "no transitions, nothing written")
+        return 0
+    layout = TraceLayout.parse(args.layout or model.meta.get("trace_layout") or ", ".join(f"{n}:1" for n in model.inputs()))
+    if args.cmd == "rom":
+        g, paths = write_rom(FSMSimulator(model, layout.fields), args.outdir)
+        print(f"ROM {1 << g.aw} x {g.dw} bit: " + ", ".join(paths))
+    elif args.cmd == "testbench":
+        sim = FSMSimulator(model, layout.fields)
+        chunks = trace_chunks(args.trace, layout, limit=args.vectors) if args.trace else random_chunks([w for _, w in layout.fields], args.vectors, seed=args.seed)
+        count, paths = write_testbench(sim, args.outdir, chunks)
+        print(f"{count} vectors: " + ", ".join(paths))
+    elif args.cmd == "replay":
+        sim, t0 = FSMSimulator(model, layout.fields), time.perf_counter()
+        with open(args.vcd, 'w') if args.vcd else open(os.devnull, 'w') as f_vcd:
+            cov = CoverageCounter(sim); vcd = [VCDWriter(f_vcd, sim)] if args.vcd else []
+            out_layout, rest = replay_trace(sim, args.trace, args.output, [cov] + vcd, chunk=args.chunk)
+            for sink in vcd: sink.close()
+        print(f"{sim.cycle} cycles in {time.perf_counter() - t0:.2f}s, output layout: {out_layout.spec()}")
+        if args.coverage: print("\n".join(coverage_report(model, cov)))
+        if rest: print(f"warning: ignored {rest} trailing bytes")
+    return 0
+
+CLI_COMMANDS = ("replay", "testbench", "rom", "decompose", "diagram")
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS: sys.exit(run_cli(sys.argv[1:]))
     app = QApplication(sys.argv)
     window = FSMVisualizerApp(); window.show(); sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,25 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import fsm1_0_0 as fsm
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), "..", "examples", "101_detector.json")
+
+
+def test_testbench_creates_missing_outdir(tmp_path):
+    out_dir = tmp_path / "new" / "tb"
+    assert fsm.run_cli(["testbench", EXAMPLE, str(out_dir), "--vectors", "20", "--seed", "1"]) == 0
+    for name in ("tb_fsm.v", "fsm_core.v", "fsm_stim.mem", "fsm_expect.mem"):
+        assert (out_dir / name).is_file()
+    assert len((out_dir / "fsm_expect.mem").read_text().split()) == 20
+
+
+def test_decompose_keeps_single_part_without_depth_gain():
+    n = 40
+    rows = [(f"S{i}", f"S{(i + 1) % n}", "go == 1'b1", f"po = 1'b{i % 2}") for i in range(n)]
+    model = fsm.FSMModel(rows, [], "S0", "Binary")
+    parts, scores = fsm.decompose_fsm(model, 6)
+    # 存在级数相同但 LUT 更少的划分，仍不应采用
+    assert any(k > 1 and d == scores[1][0] and l < scores[1][1] for k, (d, l, _) in scores.items())
+    assert len(parts) == 1